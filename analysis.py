@@ -1,54 +1,33 @@
 # analysis.py
 import os
-import json
+import re
+import string
+import functools
+import logging
+import queue
+import threading
+from collections import OrderedDict
+import numpy as np
 from dotenv import load_dotenv
-from langchain_classic.prompts import PromptTemplate
-from langchain_classic.chains import RetrievalQA
+from langchain_core.prompts import ChatPromptTemplate
 # from langchain_community.llms import Grok
-from langchain_groq import ChatGroq
-from langchain_text_splitters import CharacterTextSplitter
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import BaseCallbackHandler
+from utils import load_config
 
 # Load environment variables
 load_dotenv()
 
-def initialise_llm(config_path="config.json"):
-    """
-    Initialize LLM with Llama 3 model using config file
-    """
-    # Load configuration
-    with open(config_path) as f:
-        config = json.load(f)
-    
-    llm = ChatGroq(
-        api_key=config["grok_api_key"],
-        model=config["model"]
-    )
-    return llm
+logger = logging.getLogger(__name__)
 
-
-def create_chain(vectorstore):
-    llm = initialise_llm()
-    
-    # OPTIMIZED FOR COMPLETE CONTENT: Get more chunks for full procedures
-    retriever = vectorstore.as_retriever(
-        search_type="mmr",  # Maximum Marginal Relevance - reduces redundancy
-        search_kwargs={
-            "k": 30,           # Increased significantly for complete procedures
-            "fetch_k": 80,     # More candidates to ensure complete content
-            "lambda_mult": 0.6 # More diversity to get different parts of procedures
-        }
-    )
-    print()
-    # INTELLIGENT & FLEXIBLE PROMPT: Adapts to any cybersecurity document
-    prompt = PromptTemplate(
-        template="""You are an experienced cybersecurity analyst. Your job is to find and present ONLY the exact information from the documents that answers the user's question.
-
-Document Context: {context}
-
-Question: {question}
+# INTELLIGENT & FLEXIBLE PROMPT: Adapts to any cybersecurity document
+# Built once at import time and shared by every chain instead of re-parsed per chain build.
+# The system message is a fixed string and the per-query parts follow as separate messages,
+# so the long instruction prefix is identical on every request (provider prompt caching).
+_QA_SYSTEM_PROMPT = """You are an experienced cybersecurity analyst. Your job is to find and present ONLY the exact information from the documents that answers the user's question.
 
 CRITICAL REQUIREMENTS:
-1. **ONLY answer based on the provided document context above**
+1. **ONLY answer based on the provided document context**
 2. **If the specific information is NOT in the documents, you MUST say "No related information is present in the document"**
 3. **Do NOT make assumptions or provide general knowledge - stick strictly to what's in the documents**
 4. **Match the user's exact question - do not substitute similar terms**
@@ -68,23 +47,280 @@ RESPONSE GUIDELINES:
 - If the question is like 'Is X a vendor?' and X is not present in the vendor list, display 'No, X is not a vendor.'
 - Maintain the original document's numbering, bullet points, and organization
 - Keep technical terms, tool names, and specific instructions exactly as written
+- Do NOT fill in gaps with general cybersecurity knowledge"""
+
+_QA_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", _QA_SYSTEM_PROMPT),
+    ("human", "Document Context: {context}\n\nQuestion: {question}\n\nYour response:")
+])
+
+_CONVO_SYSTEM_PROMPT = """You are an experienced cybersecurity analyst. Your job is to find and present ONLY the exact information from the documents that answers the user's question, considering the conversation history.
+
+CRITICAL REQUIREMENTS:
+1. **ONLY answer based on the provided document context**
+2. **If the specific information is NOT in the documents, you MUST say "No related information is present in the document"**
+3. **Do NOT make assumptions or provide general knowledge - stick strictly to what's in the documents**
+4. **Match the user's exact question - do not substitute similar terms**
+5. **Consider conversation history but still only use document information**
+6. **If the question is like 'Is X a vendor?' and X is not present in the vendor list, display 'No, X is not a vendor.'**
+
+DOCUMENT PRIORITIZATION RULES:
+- **For vendor/supplier/company questions**: ONLY use information from "Vendor list.pdf" document. Ignore any vendor mentions in alert runbooks.
+- **For investigation procedures**: Use information from "Investigation Runbook" or "Alert Runbook" documents.
+- **For post-incident steps**: Use information from alert runbooks and investigation procedures.
+- **Always prioritize the most relevant document type** for the specific question being asked.
+
+INSTRUCTIONS:
+1. **Consider the conversation context** - build upon previous questions and answers when relevant
+2. **Carefully examine the document context** to see if it contains information that directly answers the current question
+3. **Choose the RIGHT DOCUMENT SOURCE** - if asking about vendors/suppliers/companies, extract ONLY from "Vendor list.pdf", NOT from alert runbooks
+4. **If relevant information exists**: Present it exactly as written in the documents, preserving formatting and structure
+5. **If no relevant information exists**: State "No related information is present in the document" 
+6. **Do not provide similar but different information** (e.g., don't answer about "password spray" when asked about "pass the ticket")
+7. **Maintain document authenticity** - use the exact text, formatting, and structure from the original documents
+
+RESPONSE GUIDELINES:
+- **VENDOR QUESTIONS**: Extract information EXCLUSIVELY from "Vendor list.pdf" - ignore any vendor mentions in other documents
+- Start by checking if the document context actually contains information about what was asked
+- If yes: provide the complete relevant information from the documents with proper formatting
+- If no: clearly state "No related information is present in the document"
+- If the question is like 'Is X a vendor?' and X is not present in the vendor list, display 'No, X is not a vendor.'
+- Maintain the original document's numbering, bullet points, and organization
+- Keep technical terms, tool names, and specific instructions exactly as written
 - Do NOT fill in gaps with general cybersecurity knowledge
+- Reference previous conversation when it adds context to the current answer"""
+
+# Shared by create_chain_with_memory and create_enhanced_chain_with_validation. Chat history
+# only grows between turns, so it sits before the per-query context to extend the stable prefix.
+_CONVO_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", _CONVO_SYSTEM_PROMPT),
+    ("human", "Chat History: {chat_history}"),
+    ("human", "Document Context: {context}\n\nQuestion: {question}\n\nYour response:")
+])
+
+# Set once the process-wide LangChain LLM cache has been registered
+_LLM_CACHE_INITIALISED = False
+
+def initialise_llm_cache(cache_path=".langchain_cache.db"):
+    """
+    Register a persistent SQLite LLM cache so identical prompts skip the Groq API call
+    """
+    global _LLM_CACHE_INITIALISED
+    if _LLM_CACHE_INITIALISED or not cache_path:
+        return
+    from langchain_core.globals import set_llm_cache
+    from langchain_community.cache import SQLiteCache
+
+    set_llm_cache(SQLiteCache(database_path=cache_path))
+    _LLM_CACHE_INITIALISED = True
+
+@functools.lru_cache(maxsize=4)
+def initialise_llm(config_path="config.json"):
+    """
+    Initialize LLM with Llama 3 model using config file.
+    The client is cached per config path so every chain reuses its HTTP session.
+    """
+    # Load configuration
+    config = load_config(config_path)
+
+    # Cache keys cover the full prompt (question, chat history and retrieved context),
+    # so only genuinely repeated requests are answered from the cache
+    initialise_llm_cache(config.get("llm_cache_file", ".langchain_cache.db"))
+    
+    from langchain_groq import ChatGroq
+
+    llm = ChatGroq(
+        api_key=config["grok_api_key"],
+        model=config["model"],
+        max_retries=config.get("llm_max_retries", 2),
+        timeout=config.get("llm_timeout", 60),
+        streaming=True  # emit tokens through callbacks as they arrive (see StreamedChainResponse)
+    )
+    return llm
+
+# Tag carried by the question-condensing LLM so its output is never streamed as the answer
+_CONDENSE_TAG = "condense_question"
+
+@functools.lru_cache(maxsize=4)
+def initialise_condense_llm(config_path="config.json"):
+    """
+    Small, fast model used only to rewrite follow-up questions into standalone search queries
+    """
+    from langchain_groq import ChatGroq
+
+    config = load_config(config_path)
+    return ChatGroq(
+        api_key=config["grok_api_key"],
+        model=config.get("condense_model", "llama-3.1-8b-instant"),
+        max_retries=config.get("llm_max_retries", 2),
+        timeout=config.get("llm_timeout", 60),
+        tags=[_CONDENSE_TAG]  # lets streaming skip the rewritten question
+    )
+
+# Built stateless chains keyed by builder and the identity of their arguments. Each entry also
+# holds the arguments themselves so their ids cannot be reused by new objects while the entry is
+# cached. Memory-backed chains are not memoised: each belongs to one session, which keeps it in
+# its own state, and caching them here would pin chat transcripts and old vectorstores in memory.
+_CHAIN_CACHE = OrderedDict()
+_CHAIN_CACHE_SIZE = 8
+_CHAIN_CACHE_LOCK = threading.Lock()
+
+def _cached_chain(builder, *args):
+    """
+    Return the chain built by builder(*args), reusing it while the same vectorstore/memory objects are passed
+    """
+    key = (builder.__name__,) + tuple(id(arg) for arg in args)
+    with _CHAIN_CACHE_LOCK:
+        if key in _CHAIN_CACHE:
+            _CHAIN_CACHE.move_to_end(key)
+            return _CHAIN_CACHE[key][1]
+
+    chain = builder(*args)
+
+    with _CHAIN_CACHE_LOCK:
+        _CHAIN_CACHE[key] = (args, chain)
+        if len(_CHAIN_CACHE) > _CHAIN_CACHE_SIZE:
+            _CHAIN_CACHE.popitem(last=False)
+    return chain
+
+def swap_vectorstore(chain, vectorstore):
+    """
+    Point an existing chain's retriever at a new vectorstore, keeping its LLM clients, prompts and memory
+    """
+    retriever = chain.retriever
+    # Validated chains wrap the vectorstore retriever
+    inner_retriever = getattr(retriever, "retriever", retriever)
+    old_vectorstore = inner_retriever.vectorstore
+    inner_retriever.vectorstore = vectorstore
+
+    # Re-key a memoised stateless chain so later create_chain calls with the new vectorstore find it
+    with _CHAIN_CACHE_LOCK:
+        for key, (args, cached_chain) in list(_CHAIN_CACHE.items()):
+            if cached_chain is chain:
+                del _CHAIN_CACHE[key]
+                new_args = tuple(vectorstore if arg is old_vectorstore else arg for arg in args)
+                new_key = (key[0],) + tuple(id(arg) for arg in new_args)
+                _CHAIN_CACHE[new_key] = (new_args, chain)
+                break
+    return chain
+
+def _build_chain(vectorstore, debug):
+    """
+    Stateless RetrievalQA chain; set debug=True to get the retrieved chunks back with each answer
+    """
+    from langchain_classic.chains import RetrievalQA
 
-Your response:""",
-        input_variables=["context", "question"] 
+    llm = initialise_llm()
+    
+    # OPTIMIZED FOR COMPLETE CONTENT: Get more chunks for full procedures
+    retriever = vectorstore.as_retriever(
+        search_type="mmr",  # Maximum Marginal Relevance - reduces redundancy
+        search_kwargs={
+            "k": 30,           # Increased significantly for complete procedures
+            "fetch_k": 80,     # More candidates to ensure complete content
+            "lambda_mult": 0.6 # More diversity to get different parts of procedures
+        }
     )
 
-    # KEEP YOUR SIMPLE APPROACH: Same chain type, just enable source docs for debugging
+    # KEEP YOUR SIMPLE APPROACH: Same chain type, source docs only returned when debugging
     chain = RetrievalQA.from_chain_type(
         llm=llm,
         retriever=retriever,
-        chain_type_kwargs={"prompt": prompt},
-        return_source_documents=True  # Changed to True so you can debug what was retrieved
+        chain_type_kwargs={"prompt": _QA_PROMPT},
+        return_source_documents=debug
     )
 
     return chain
 
-def create_chain_with_memory(vectorstore, memory):
+def create_chain(vectorstore, debug=False):
+    """Stateless RetrievalQA chain, built once per vectorstore"""
+    return _cached_chain(_build_chain, vectorstore, debug)
+
+def answer_questions_batch(chain, questions, max_concurrency=10):
+    """
+    Answer several questions concurrently so the Groq calls overlap instead of running one by one.
+    Only use with stateless chains (create_chain) - memory-backed chains would interleave history.
+    """
+    import asyncio
+
+    input_key = chain.input_keys[0]
+    inputs = [{input_key: question} for question in questions]
+    return asyncio.run(chain.abatch(inputs, config={"max_concurrency": max_concurrency}))
+
+# Marks the end of a streamed response in the token queue
+_STREAM_DONE = object()
+
+class _AnswerTokenHandler(BaseCallbackHandler):
+    """
+    Forwards tokens from the answering LLM (not the question condenser) into a queue.
+    With a relevance_check, the retrieved documents are checked as soon as retrieval ends,
+    before the answer starts, and tokens are withheld if they fail.
+    """
+
+    def __init__(self, token_queue, relevance_check=None):
+        self.token_queue = token_queue
+        self.relevance_check = relevance_check
+        self.answer_runs = set()
+        self.answer_withheld = False
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        if self.relevance_check is not None:
+            self.answer_withheld = not self.relevance_check(documents)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, **kwargs):
+        if _CONDENSE_TAG not in (tags or []):
+            self.answer_runs.add(run_id)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if token and run_id in self.answer_runs and not self.answer_withheld:
+            self.token_queue.put(token)
+
+class StreamedChainResponse:
+    """
+    Runs a chain in a background thread and yields the answer tokens as Groq produces them.
+    Iterate over it for the text; `result` holds the full chain output (including
+    source_documents) once iteration has finished.
+    Pass relevance_check (called with the retrieved documents) to yield nothing for answers
+    whose context fails it; `answer_withheld` is then True.
+    """
+
+    def __init__(self, chain, inputs, relevance_check=None):
+        self.result = None
+        self._output_key = chain.output_keys[0]
+        self._error = None
+        self._tokens = queue.Queue()
+        self._handler = _AnswerTokenHandler(self._tokens, relevance_check)
+        self._thread = threading.Thread(target=self._run, args=(chain, inputs), daemon=True)
+        self._thread.start()
+
+    @property
+    def answer_withheld(self):
+        return self._handler.answer_withheld
+
+    def _run(self, chain, inputs):
+        try:
+            self.result = chain.invoke(inputs, config={"callbacks": [self._handler]})
+        except Exception as e:
+            self._error = e
+        finally:
+            self._tokens.put(_STREAM_DONE)
+
+    def __iter__(self):
+        streamed_any = False
+        while True:
+            token = self._tokens.get()
+            if token is _STREAM_DONE:
+                break
+            streamed_any = True
+            yield token
+
+        if self._error is not None:
+            raise self._error
+        if not streamed_any and not self.answer_withheld:
+            # Answers served from the LLM cache arrive without token callbacks
+            yield self.result[self._output_key]
+
+def _build_chain_with_memory(vectorstore, memory):
     """
     Enhanced conversational chain with smart query processing
     """
@@ -107,84 +343,110 @@ def create_chain_with_memory(vectorstore, memory):
         llm=llm,
         retriever=retriever,
         memory=memory,
+        # The condense step only runs once there is chat history; give it the cheap model and
+        # answer the user's original question so the main model sees their exact wording
+        condense_question_llm=initialise_condense_llm(),
+        rephrase_question=False,
+        # Always needed here: main.py runs strict relevance checks and debug logging on them
         return_source_documents=True,
         combine_docs_chain_kwargs={
-            "prompt": PromptTemplate(
-                template="""You are an experienced cybersecurity analyst. Your job is to find and present ONLY the exact information from the documents that answers the user's question, considering the conversation history.
-
-Document Context: {context}
-
-Chat History: {chat_history}
-
-Question: {question}
-
-CRITICAL REQUIREMENTS:
-1. **ONLY answer based on the provided document context above**
-2. **If the specific information is NOT in the documents, you MUST say "No related information is present in the document"**
-3. **Do NOT make assumptions or provide general knowledge - stick strictly to what's in the documents**
-4. **Match the user's exact question - do not substitute similar terms**
-5. **Consider conversation history but still only use document information**
-6. **If the question is like 'Is X a vendor?' and X is not present in the vendor list, display 'No, X is not a vendor.'**
+            "prompt": _CONVO_PROMPT
+        }
+    )
+    return chain
 
-DOCUMENT PRIORITIZATION RULES:
-- **For vendor/supplier/company questions**: ONLY use information from "Vendor list.pdf" document. Ignore any vendor mentions in alert runbooks.
-- **For investigation procedures**: Use information from "Investigation Runbook" or "Alert Runbook" documents.
-- **For post-incident steps**: Use information from alert runbooks and investigation procedures.
-- **Always prioritize the most relevant document type** for the specific question being asked.
+def create_chain_with_memory(vectorstore, memory):
+    """Conversational chain for one session's memory; the caller keeps it and repoints it with swap_vectorstore"""
+    return _build_chain_with_memory(vectorstore, memory)
 
-INSTRUCTIONS:
-1. **Consider the conversation context** - build upon previous questions and answers when relevant
-2. **Carefully examine the document context** to see if it contains information that directly answers the current question
-3. **Choose the RIGHT DOCUMENT SOURCE** - if asking about vendors/suppliers/companies, extract ONLY from "Vendor list.pdf", NOT from alert runbooks
-4. **If relevant information exists**: Present it exactly as written in the documents, preserving formatting and structure
-5. **If no relevant information exists**: State "No related information is present in the document" 
-6. **Do not provide similar but different information** (e.g., don't answer about "password spray" when asked about "pass the ticket")
-7. **Maintain document authenticity** - use the exact text, formatting, and structure from the original documents
+_POST_INCIDENT_TRIGGERS = frozenset({"after", "post", "following"})
+_INVESTIGATION_TRIGGERS = frozenset({"investigate", "analysis", "review"})
 
-RESPONSE GUIDELINES:
-- **VENDOR QUESTIONS**: Extract information EXCLUSIVELY from "Vendor list.pdf" - ignore any vendor mentions in other documents
-- Start by checking if the document context actually contains information about what was asked
-- If yes: provide the complete relevant information from the documents with proper formatting
-- If no: clearly state "No related information is present in the document"
-- If the question is like 'Is X a vendor?' and X is not present in the vendor list, display 'No, X is not a vendor.'
-- Maintain the original document's numbering, bullet points, and organization
-- Keep technical terms, tool names, and specific instructions exactly as written
-- Do NOT fill in gaps with general cybersecurity knowledge
-- Reference previous conversation when it adds context to the current answer
+# All enhancement keywords compiled into one alternation (longest first) so a question is
+# scanned once instead of once per keyword; matches substrings like the original `in` checks
+_ENHANCEMENT_KEYWORDS = re.compile("|".join(
+    sorted(_POST_INCIDENT_TRIGGERS | _INVESTIGATION_TRIGGERS | {"incident", "investigation"}, key=len, reverse=True)
+))
 
-Your response:""",
-                input_variables=["context", "chat_history", "question"]
-            )
-        }
-    )
-    return chain
+class SemanticCache:
+    """
+    Cache of chain responses keyed by question embeddings, safe to share between sessions.
+    A new question whose cosine similarity to an earlier one reaches the threshold reuses that
+    answer instead of running retrieval and the LLM again. Answers to follow-ups depend on chat
+    history, so callers should only use it for questions asked without any.
+    """
 
+    def __init__(self, embedding_model):
+        self.embedding_model = embedding_model
+        self.index = None  # faiss.IndexFlatIP, created on the first add
+        self.responses = []
+        self._lock = threading.Lock()  # FAISS indexes cannot be searched while another thread adds
+
+    def embed(self, question):
+        import faiss
+
+        vector = np.asarray([self.embedding_model.embed_query(question)], dtype=np.float32)
+        faiss.normalize_L2(vector)  # inner product of unit vectors == cosine similarity
+        return vector
+
+    def lookup(self, vector, threshold):
+        """Return a copy of the cached response for the closest earlier question, or None"""
+        with self._lock:
+            if self.index is None or self.index.ntotal == 0:
+                return None
+            scores, positions = self.index.search(vector, 1)
+            if scores[0][0] >= threshold:
+                logger.debug("⚡ Semantic cache hit (similarity %.3f)", scores[0][0])
+                return dict(self.responses[positions[0][0]])
+        return None
+
+    def add(self, vector, response):
+        import faiss
+
+        with self._lock:
+            if self.index is None:
+                self.index = faiss.IndexFlatIP(vector.shape[1])
+            self.index.add(vector)
+            self.responses.append({
+                "answer": response["answer"],
+                "source_documents": response.get("source_documents", [])
+            })
+
+@functools.lru_cache(maxsize=512)
 def enhance_query_for_better_retrieval(question):
     """
-    More conservative query enhancement that preserves exact user intent
+    More conservative query enhancement that preserves exact user intent.
+    Pure function of the question, so repeated questions are answered from the cache.
     """
-    question_lower = question.lower()
+    # Single scan of the question for every trigger keyword
+    found_keywords = set(_ENHANCEMENT_KEYWORDS.findall(question.lower()))
     
     # Only enhance if we're confident it won't change the meaning
     enhanced_terms = []
     
     # Very minimal enhancement - only add terms that clarify context without changing meaning
-    if any(word in question_lower for word in ["after", "post", "following"]) and "incident" not in question_lower:
+    if found_keywords & _POST_INCIDENT_TRIGGERS and "incident" not in found_keywords:
         enhanced_terms.append("post-incident")
     
     # Only add "investigation" if they're clearly asking about investigating something
-    if any(word in question_lower for word in ["investigate", "analysis", "review"]) and "investigation" not in question_lower:
+    if found_keywords & _INVESTIGATION_TRIGGERS and "investigation" not in found_keywords:
         enhanced_terms.append("investigation") 
     
     # Be very conservative - only add one enhancement term max to avoid confusion
     if enhanced_terms:
         enhanced_query = f"{question} {enhanced_terms[0]}"  # Only use first term
-        print(f"🔍 Conservatively enhanced query: {enhanced_query}")
+        logger.debug("🔍 Conservatively enhanced query: %s", enhanced_query)
         return enhanced_query
     
-    print(f"🔍 Using original query (no enhancement needed): {question}")
+    logger.debug("🔍 Using original query (no enhancement needed): %s", question)
     return question
 
+# Common words that don't indicate relevance
+_STOP_WORDS = frozenset({'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was', 'were', 'how', 'what', 'when', 'where', 'why', 'do', 'does', 'did', 'can', 'will', 'would', 'should'})
+
+# Strips punctuation so "ticket?" and "ticket" count as the same word
+_PUNCT_TABLE = str.maketrans("", "", string.punctuation)
+
 def validate_chunk_relevance(query, chunks, threshold=0.3):
     """
     Validate if retrieved chunks are actually relevant to the user's query
@@ -193,39 +455,57 @@ def validate_chunk_relevance(query, chunks, threshold=0.3):
     if not chunks:
         return False
     
-    query_lower = query.lower()
-    query_words = set(query_lower.split())
+    query_words = set(query.lower().translate(_PUNCT_TABLE).split())
     
     # Remove common words that don't indicate relevance
-    stop_words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was', 'were', 'how', 'what', 'when', 'where', 'why', 'do', 'does', 'did', 'can', 'will', 'would', 'should'}
-    meaningful_query_words = query_words - stop_words
+    meaningful_query_words = query_words - _STOP_WORDS
     
     if not meaningful_query_words:
         return True  # If no meaningful words, proceed with retrieval
     
-    # Check if any chunk contains meaningful overlap with the query
+    # Check chunks in retrieval order and stop at the first one with enough overlap with the query
     for chunk in chunks:
-        chunk_text = chunk.page_content.lower()
-        chunk_words = set(chunk_text.split())
+        chunk_words = set(chunk.page_content.lower().translate(_PUNCT_TABLE).split())
         
         # Calculate overlap ratio
-        overlap = meaningful_query_words.intersection(chunk_words)
-        overlap_ratio = len(overlap) / len(meaningful_query_words)
+        overlap_ratio = len(meaningful_query_words & chunk_words) / len(meaningful_query_words)
         
         if overlap_ratio >= threshold:
-            print(f"✅ Found relevant chunk with {overlap_ratio:.2f} relevance score")
+            logger.debug("✅ Found relevant chunk with %.2f relevance score", overlap_ratio)
             return True
     
-    print(f"⚠️ No chunks seem relevant to query: '{query}'")
-    print(f"   Query keywords: {meaningful_query_words}")
+    logger.debug("⚠️ No chunks seem relevant to query: '%s'", query)
+    logger.debug("   Query keywords: %s", meaningful_query_words)
     return False
 
-def create_enhanced_chain_with_validation(vectorstore, memory):
+def _keep_if_relevant(query, chunks):
+    # Validate if chunks are actually relevant
+    if not validate_chunk_relevance(query, chunks):
+        logger.debug("🚫 Chunks don't seem relevant - returning empty context")
+        return []  # Return empty to trigger "no information" response
+    return chunks
+
+class RelevanceValidatedRetriever(BaseRetriever):
     """
-    Enhanced chain that validates chunk relevance before generating response
+    Wraps a retriever and returns no context when none of the retrieved chunks look relevant.
+    The async path awaits the inner retriever so async vectorstore clients are not blocked.
+    """
+    retriever: BaseRetriever
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        chunks = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return _keep_if_relevant(query, chunks)
+
+    async def _aget_relevant_documents(self, query, *, run_manager):
+        chunks = await self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        return _keep_if_relevant(query, chunks)
+
+def _build_enhanced_chain_with_validation(vectorstore, memory, debug):
+    """
+    Enhanced chain that validates chunk relevance before generating response.
+    Set debug=True to get the retrieved chunks back with each answer.
     """
     from langchain_classic.chains import ConversationalRetrievalChain
-    from langchain_core.runnables import RunnableLambda
     
     llm = initialise_llm()
     
@@ -239,70 +519,20 @@ def create_enhanced_chain_with_validation(vectorstore, memory):
         }
     )
     
-    # Custom validation wrapper for the retriever
-    def validated_retrieval(query):
-        chunks = retriever.get_relevant_documents(query)
-        
-        # Validate if chunks are actually relevant
-        if not validate_chunk_relevance(query, chunks):
-            print("🚫 Chunks don't seem relevant - returning empty context")
-            return []  # Return empty to trigger "no information" response
-        
-        return chunks
-    
     # Create conversational chain with validation
     chain = ConversationalRetrievalChain.from_llm(
         llm=llm,
-        retriever=retriever,  # We'll handle validation in main.py
+        retriever=RelevanceValidatedRetriever(retriever=retriever),
         memory=memory,
-        return_source_documents=True,
+        condense_question_llm=initialise_condense_llm(),
+        rephrase_question=False,
+        return_source_documents=debug,
         combine_docs_chain_kwargs={
-            "prompt": PromptTemplate(
-                template="""You are an experienced cybersecurity analyst. Your job is to find and present ONLY the exact information from the documents that answers the user's question, considering the conversation history.
-
-Document Context: {context}
-
-Chat History: {chat_history}
-
-Question: {question}
-
-CRITICAL REQUIREMENTS:
-1. **ONLY answer based on the provided document context above**
-2. **If the specific information is NOT in the documents, you MUST say "No related information is present in the document"**
-3. **Do NOT make assumptions or provide general knowledge - stick strictly to what's in the documents**
-4. **Match the user's exact question - do not substitute similar terms**
-5. **Consider conversation history but still only use document information**
-6. **If the question is like 'Is X a vendor?' and X is not present in the vendor list, display 'No, X is not a vendor.'**
-
-DOCUMENT PRIORITIZATION RULES:
-- **For vendor/supplier/company questions**: ONLY use information from "Vendor list.pdf" document. Ignore any vendor mentions in alert runbooks.
-- **For investigation procedures**: Use information from "Investigation Runbook" or "Alert Runbook" documents.
-- **For post-incident steps**: Use information from alert runbooks and investigation procedures.
-- **Always prioritize the most relevant document type** for the specific question being asked.
-
-INSTRUCTIONS:
-1. **Consider the conversation context** - build upon previous questions and answers when relevant
-2. **Carefully examine the document context** to see if it contains information that directly answers the current question
-3. **Choose the RIGHT DOCUMENT SOURCE** - if asking about vendors/suppliers/companies, extract ONLY from "Vendor list.pdf", NOT from alert runbooks
-4. **If relevant information exists**: Present it exactly as written in the documents, preserving formatting and structure
-5. **If no relevant information exists**: State "No related information is present in the document" 
-6. **Do not provide similar but different information** (e.g., don't answer about "password spray" when asked about "pass the ticket")
-7. **Maintain document authenticity** - use the exact text, formatting, and structure from the original documents
-
-RESPONSE GUIDELINES:
-- **VENDOR QUESTIONS**: Extract information EXCLUSIVELY from "Vendor list.pdf" - ignore any vendor mentions in other documents
-- Start by checking if the document context actually contains information about what was asked
-- If yes: provide the complete relevant information from the documents with proper formatting
-- If no: clearly state "No related information is present in the document"
-- If the question is like 'Is X a vendor?' and X is not present in the vendor list, display 'No, X is not a vendor.'
-- Maintain the original document's numbering, bullet points, and organization
-- Keep technical terms, tool names, and specific instructions exactly as written
-- Do NOT fill in gaps with general cybersecurity knowledge
-- Reference previous conversation when it adds context to the current answer
-
-Your response:""",
-                input_variables=["context", "chat_history", "question"]
-            )
+            "prompt": _CONVO_PROMPT
         }
     )
     return chain
+
+def create_enhanced_chain_with_validation(vectorstore, memory, debug=False):
+    """Relevance-validated conversational chain for one session's memory; the caller keeps it"""
+    return _build_enhanced_chain_with_validation(vectorstore, memory, debug)
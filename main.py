@@ -1,6 +1,14 @@
+import logging
+import threading
 import streamlit as st
-from utils import load_documents_from_folder_incremental, get_session_memory, process_uploaded_files, clear_vectorstore_and_cache, log_retrieved_chunks_for_debugging, analyze_chunk_coverage
-from analysis import create_chain_with_memory, enhance_query_for_better_retrieval, validate_chunk_relevance
+from utils import load_documents_from_folder_incremental, get_session_memory, process_uploaded_files, clear_vectorstore_and_cache, log_retrieved_chunks_for_debugging, analyze_chunk_coverage, deduplicate_chunks
+from analysis import create_chain_with_memory, enhance_query_for_better_retrieval, validate_chunk_relevance, SemanticCache, StreamedChainResponse, swap_vectorstore
+
+# Root stays at WARNING so library chatter (httpx, sentence-transformers) is hidden; only the
+# app's own loggers report at INFO. Set them to logging.DEBUG to see per-query chunk dumps
+logging.basicConfig(format="%(message)s")
+for _logger_name in ("utils", "analysis"):
+    logging.getLogger(_logger_name).setLevel(logging.INFO)
 
 st.set_page_config(
     page_title="AI Doc Assistant",
@@ -110,29 +118,56 @@ header {visibility: hidden;}
 if "memory" not in st.session_state:
     st.session_state.memory = get_session_memory()
 
+@st.cache_resource(show_spinner=False)
+def get_document_index():
+    """
+    Vectorstore and processing info shared by every browser session, loaded once per process.
+    Sidebar actions build an updated copy of the vectorstore and swap it into the returned dict,
+    so sessions still searching the old one are never disturbed. "update_lock" serialises those
+    actions so one session's update always starts from the other's result.
+    """
+    _, vectorstore, processing_info = load_documents_from_folder_incremental()
+    return {"vectorstore": vectorstore, "processing_info": processing_info, "update_lock": threading.Lock()}
+
+@st.cache_resource(show_spinner=False)
+def get_shared_semantic_cache():
+    """Holder for the semantic answer cache shared by every session; see get_semantic_cache"""
+    return {"vectorstore": None, "cache": None, "lock": threading.Lock()}
+
+def get_semantic_cache(vectorstore):
+    """
+    Process-wide cache of answers to standalone questions, so any session's first question can
+    reuse another session's answer. Replaced whenever the documents change (a new vectorstore).
+    """
+    shared = get_shared_semantic_cache()
+    with shared["lock"]:
+        if shared["vectorstore"] is not vectorstore:
+            shared["vectorstore"] = vectorstore
+            shared["cache"] = SemanticCache(vectorstore.embeddings)
+        return shared["cache"]
+
 # Load documents and vectorstore
-if "vectorstore" not in st.session_state:
-    with st.spinner("Loading documents from backend folder..."):
-        try:
-            new_documents, vectorstore, processing_info = load_documents_from_folder_incremental()
-            if vectorstore:
-                st.session_state.vectorstore = vectorstore
-                st.session_state.processing_info = processing_info
-                total = processing_info['total_documents']
-                new = processing_info['new_documents']
-                reused = processing_info['reused_documents']
-                # if new > 0:
-                #     st.success(f"✅ Processing Complete! Total: {total} docs | New: {new} | Reused: {reused}")
-                # else:
-                #     st.info(f"✅ Documents Loaded! Total: {total} docs (all from cache)")
-            else:
-                st.error("No documents found in the backend folder. Please add documents to the 'sop_documents' folder.")
-                st.info("📁 Add your SOP documents (PDF, DOCX, CSV, XLSX, TXT) to the 'sop_documents' folder and restart the app.")
-                st.stop()
-        except Exception as e:
-            st.error(f"Error loading documents: {e}")
-            st.info("💡 Make sure your documents are in supported formats and not corrupted.")
-            st.stop()
+with st.spinner("Loading documents from backend folder..."):
+    try:
+        document_index = get_document_index()
+    except Exception as e:
+        st.error(f"Error loading documents: {e}")
+        st.info("💡 Make sure your documents are in supported formats and not corrupted.")
+        st.stop()
+
+if not document_index["vectorstore"]:
+    get_document_index.clear()  # look for documents again on the next run
+    st.error("No documents found in the backend folder. Please add documents to the 'sop_documents' folder.")
+    st.info("📁 Add your SOP documents (PDF, DOCX, CSV, XLSX, TXT) to the 'sop_documents' folder and restart the app.")
+    st.stop()
+
+# Repoint this session's chain when the shared vectorstore changes; every update swaps in a new
+# vectorstore object
+if st.session_state.get("vectorstore") is not document_index["vectorstore"]:
+    st.session_state.vectorstore = document_index["vectorstore"]
+    if "conversation_chain" in st.session_state:
+        swap_vectorstore(st.session_state.conversation_chain, st.session_state.vectorstore)
+st.session_state.processing_info = document_index["processing_info"]
 
 # Initialize conversation chain
 if "conversation_chain" not in st.session_state:
@@ -191,22 +226,24 @@ with st.sidebar:
             with st.spinner("Processing documents..."):
                 try:
                     # Process uploaded files - save to sop_documents and add to vectorstore
-                    processed_count, updated_vectorstore = process_uploaded_files(uploaded_files)
+                    parse_progress = st.progress(0.0, text="Parsing documents...")
+                    with document_index["update_lock"]:
+                        processed_count, updated_vectorstore, processing_info = process_uploaded_files(
+                            uploaded_files,
+                            vectorstore=document_index["vectorstore"],
+                            progress_callback=lambda done, total: parse_progress.progress(
+                                done / total, text=f"Parsed {done}/{total} documents"
+                            )
+                        )
+                        if processed_count > 0:
+                            # Publish the updated copy to every session; chains are repointed on rerun
+                            document_index["vectorstore"] = updated_vectorstore
+                            
+                            # Update processing info
+                            document_index["processing_info"] = processing_info
+                    parse_progress.empty()
                     
                     if processed_count > 0:
-                        # Update session state with new vectorstore
-                        st.session_state.vectorstore = updated_vectorstore
-                        
-                        # Recreate conversation chain with updated vectorstore
-                        st.session_state.conversation_chain = create_chain_with_memory(
-                            st.session_state.vectorstore, 
-                            st.session_state.memory
-                        )
-                        
-                        # Update processing info
-                        _, _, processing_info = load_documents_from_folder_incremental()
-                        st.session_state.processing_info = processing_info
-                        
                         st.success(f"✅ Successfully processed {processed_count} documents!")
                         st.success(f"📁 Files saved to sop_documents folder")
                         st.success(f"🧠 Vector database updated with {processed_count} new documents")
@@ -245,21 +282,28 @@ with st.sidebar:
     if st.button("🔄 Refresh Documents", use_container_width=True):
         with st.spinner("🔍 Refreshing..."):
             try:
-                new_documents, vectorstore, processing_info = load_documents_from_folder_incremental()
-                if new_documents:
-                    st.session_state.vectorstore = vectorstore
-                    st.session_state.processing_info = processing_info
-                    st.session_state.conversation_chain = create_chain_with_memory(
-                        st.session_state.vectorstore, 
-                        st.session_state.memory
+                # Apply only the added, changed and deleted files to a copy of the shared index, then publish it
+                with document_index["update_lock"]:
+                    new_documents, vectorstore, processing_info = load_documents_from_folder_incremental(
+                        vectorstore=document_index["vectorstore"]
                     )
+                    document_index["vectorstore"] = vectorstore
+                    document_index["processing_info"] = processing_info
+                if new_documents:
                     st.success(f"✅ Found {len(new_documents)} new documents!")
+                elif processing_info.get("removed_documents"):
+                    st.success(f"🧹 Removed {processing_info['removed_documents']} deleted documents")
                 else:
                     st.info("ℹ️ No new documents found.")
             except Exception as e:
                 st.error(f"❌ Error: {e}")
             st.rerun()
     
+    # Shown until a refresh manages to remove them, since the buttons above rerun the page
+    pending_removals = (document_index["processing_info"] or {}).get("pending_removals")
+    if pending_removals:
+        st.warning(f"⚠️ Old chunks of {pending_removals} changed or deleted documents could not be removed yet and may still appear in answers. Click Refresh Documents to retry.")
+    
     # Danger Zone - Clear Vector Database
     st.markdown("""
     <div style='margin: 1.5rem 0;'>
@@ -282,13 +326,15 @@ with st.sidebar:
                 try:
                     success = clear_vectorstore_and_cache()
                     if success:
-                        # Clear session state
+                        # Drop the shared index and this session's state
+                        get_document_index.clear()
                         if "vectorstore" in st.session_state:
                             del st.session_state.vectorstore
                         if "processing_info" in st.session_state:
                             del st.session_state.processing_info
                         if "conversation_chain" in st.session_state:
                             del st.session_state.conversation_chain
+                        get_shared_semantic_cache.clear()
                         
                         st.success("✅ Vector database and cache cleared successfully!")
                         st.info("💡 Please restart the app or refresh documents to process new files.")
@@ -414,92 +460,124 @@ if user_input:
                 # Enhance the query for better retrieval
                 enhanced_query = enhance_query_for_better_retrieval(user_input)
                 
-                # Use enhanced query for better results
-                response = st.session_state.conversation_chain({"question": enhanced_query})
+                # Reuse the answer to a semantically equivalent earlier question when there is one
+                # (stricter similarity bar in strict mode). Answers to follow-ups depend on the
+                # conversation, so only questions asked without chat history are served or stored
+                strict_mode = st.session_state.get("strict_mode", True)
+                memory = st.session_state.memory
+                use_semantic_cache = not memory.load_memory_variables({})[memory.memory_key]
+                response = None
+                if use_semantic_cache:
+                    semantic_cache = get_semantic_cache(st.session_state.vectorstore)
+                    query_vector = semantic_cache.embed(user_input)
+                    cache_threshold = 0.95 if strict_mode else 0.88
+                    response = semantic_cache.lookup(query_vector, cache_threshold)
                 
-                # Validate if retrieved chunks are actually relevant (if strict mode is enabled)
-                if "source_documents" in response and response["source_documents"]:
-                    chunks = response["source_documents"]
-                    
-                    # Use strict mode setting to determine validation
-                    if st.session_state.get("strict_mode", True):
-                        # Strict mode: validate relevance
-                        threshold = 0.25  # Higher threshold for strict mode
-                        if not validate_chunk_relevance(user_input, chunks, threshold=threshold):
-                            assistant_response = "No related information is present in the document."
-                            st.warning("⚠️ The retrieved information doesn't seem relevant to your query. Try rephrasing your question or check if the information exists in your documents.")
-                        else:
-                            assistant_response = response["answer"]
+            # Strict mode: retrieved chunks must pass this check before any of the answer is shown
+            strict_threshold = 0.25  # Higher threshold for strict mode
+            relevance_check = None
+            if strict_mode:
+                relevance_check = lambda chunks: validate_chunk_relevance(user_input, chunks, threshold=strict_threshold)
+            
+            # Tokens render as they arrive; the placeholder is rewritten once the answer is validated
+            answer_placeholder = st.empty()
+            if response is None:
+                # Use enhanced query for better results; in strict mode tokens only stream once the
+                # retrieved chunks have passed the relevance check
+                streamed_response = StreamedChainResponse(
+                    st.session_state.conversation_chain, {"question": enhanced_query},
+                    relevance_check=relevance_check
+                )
+                with answer_placeholder.container():
+                    st.write_stream(streamed_response)
+                response = streamed_response.result
+                if use_semantic_cache:
+                    semantic_cache.add(query_vector, response)
+            else:
+                # Keep conversation memory in step even though the chain was skipped, saving the
+                # same question string the chain would have
+                memory.save_context({"question": enhanced_query}, {"answer": response["answer"]})
+            
+            # Validation, logging and coverage analysis below only need each distinct chunk once
+            if response.get("source_documents"):
+                response["source_documents"] = deduplicate_chunks(response["source_documents"])
+            
+            # Validate if retrieved chunks are actually relevant (if strict mode is enabled)
+            if "source_documents" in response and response["source_documents"]:
+                chunks = response["source_documents"]
+                
+                # Use strict mode setting to determine validation
+                if strict_mode:
+                    # Strict mode: validate relevance
+                    if not relevance_check(chunks):
+                        assistant_response = "No related information is present in the document."
+                        st.warning("⚠️ The retrieved information doesn't seem relevant to your query. Try rephrasing your question or check if the information exists in your documents.")
                     else:
-                        # Non-strict mode: trust the LLM's judgment
                         assistant_response = response["answer"]
-                        st.info("ℹ️ Showing results in non-strict mode - answer may be less relevant")
                 else:
-                    assistant_response = "No related information is present in the document."
+                    # Non-strict mode: trust the LLM's judgment
+                    assistant_response = response["answer"]
+                    st.info("ℹ️ Showing results in non-strict mode - answer may be less relevant")
+            else:
+                assistant_response = "No related information is present in the document."
+            
+            # Display the main answer
+            answer_placeholder.markdown(assistant_response)
+            
+            # Log chunks for automation team debugging (console + file)
+            if "source_documents" in response and response["source_documents"]:
+                chunks = response["source_documents"]
                 
-                # Display the main answer
-                st.markdown(assistant_response)
+                # Log to file for automation team (console dump at DEBUG log level)
+                log_retrieved_chunks_for_debugging(
+                    query=user_input,
+                    chunks=chunks,
+                    enhanced_query=enhanced_query if enhanced_query != user_input else None,
+                    log_to_file=st.session_state.get("log_to_file", True)
+                )
                 
-                # Log chunks for automation team debugging (console + file)
-                if "source_documents" in response and response["source_documents"]:
-                    chunks = response["source_documents"]
-                    
-                    # Log to console and file for automation team
-                    print(f"\n🔍 AUTOMATION TEAM DEBUG - Query: {user_input}")
-                    log_retrieved_chunks_for_debugging(
-                        query=user_input,
-                        chunks=chunks,
-                        enhanced_query=enhanced_query if enhanced_query != user_input else None,
-                        log_to_file=st.session_state.get("log_to_file", True)
-                    )
-                    
-                    # Additional analysis for automation team
-                    analyze_chunk_coverage(chunks)
+                # Additional analysis for automation team
+                analyze_chunk_coverage(chunks)
+            
+            # Display retrieved chunks for automation team (only if debug mode is enabled)
+            if st.session_state.get("debug_mode", False) and "source_documents" in response and response["source_documents"]:
+                chunks = response["source_documents"]
                 
-                # Display retrieved chunks for automation team (only if debug mode is enabled)
-                if st.session_state.get("show_chunks", True) and "source_documents" in response and response["source_documents"]:
-                    chunks = response["source_documents"]
+                # Add toggle to show/hide chunks
+                with st.expander(f"🔍 **Retrieved Chunks ({len(chunks)} chunks used)**", expanded=False):
+                    st.markdown("### 📊 Chunks Retrieved for This Query")
                     
-                    # Add toggle to show/hide chunks
-                    with st.expander(f"🔍 **Retrieved Chunks ({len(chunks)} chunks used)**", expanded=False):
-                        st.markdown("### 📊 Chunks Retrieved for This Query")
-                        
-                        for i, chunk in enumerate(chunks, 1):
-                            # Create a nice card layout for each chunk
-                            st.markdown(f"""
-                            <div style='background: rgba(102, 126, 234, 0.1); padding: 1rem; border-radius: 8px; margin: 0.5rem 0; border-left: 4px solid #667eea;'>
-                                <div style='color: #667eea; font-weight: 600; font-size: 0.9rem; margin-bottom: 0.5rem;'>
-                                    📄 Chunk {i} - {chunk.metadata.get('source', 'Unknown')}
-                                </div>
-                                <div style='font-size: 0.8rem; color: #a0aec0; margin-bottom: 0.5rem;'>
-                                    📁 Type: {chunk.metadata.get('chunk_type', 'standard')} | 
-                                    📋 Index: {chunk.metadata.get('chunk_index', 'N/A')} | 
-                                    📏 Size: {len(chunk.page_content)} chars
-                                </div>
+                    for i, chunk in enumerate(chunks, 1):
+                        # Create a nice card layout for each chunk
+                        st.markdown(f"""
+                        <div style='background: rgba(102, 126, 234, 0.1); padding: 1rem; border-radius: 8px; margin: 0.5rem 0; border-left: 4px solid #667eea;'>
+                            <div style='color: #667eea; font-weight: 600; font-size: 0.9rem; margin-bottom: 0.5rem;'>
+                                📄 Chunk {i} - {chunk.metadata.get('source', 'Unknown')}
                             </div>
-                            """, unsafe_allow_html=True)
-                            
-                            # Show chunk content in a code block for easy reading
-                            st.text_area(
-                                f"Content of Chunk {i}:",
-                                value=chunk.page_content,
-                                height=150,
-                                key=f"chunk_{i}_{len(st.session_state.chat_history)}",
-                                disabled=True
-                            )
-                            
-                            # Add separator between chunks
-                            if i < len(chunks):
-                                st.markdown("---")
-                    
-                    # Summary information
-                    st.info(f"💡 **Query processed using {len(chunks)} chunks** from your document library")
-                
-                # Show chunk count even when debug mode is disabled
-                elif "source_documents" in response and response["source_documents"]:
-                    chunks_count = len(response["source_documents"])
-                    st.info(f"💡 Query processed using {chunks_count} chunks (enable debug mode to see details)")
+                            <div style='font-size: 0.8rem; color: #a0aec0; margin-bottom: 0.5rem;'>
+                                📁 Type: {chunk.metadata.get('chunk_type', 'standard')} | 
+                                📋 Index: {chunk.metadata.get('chunk_index', 'N/A')} | 
+                                📏 Size: {len(chunk.page_content)} chars
+                            </div>
+                        </div>
+                        """, unsafe_allow_html=True)
+                        
+                        # Show chunk content in a code block for easy reading
+                        # (a static element, so no widget state is registered per chunk)
+                        st.code(chunk.page_content, language=None)
+                        
+                        # Add separator between chunks
+                        if i < len(chunks):
+                            st.markdown("---")
                 
+                # Summary information
+                st.info(f"💡 **Query processed using {len(chunks)} chunks** from your document library")
+            
+            # Show chunk count even when debug mode is disabled
+            elif "source_documents" in response and response["source_documents"]:
+                chunks_count = len(response["source_documents"])
+                st.info(f"💡 Query processed using {chunks_count} chunks (enable debug mode to see details)")
+            
             st.session_state.chat_history.append({"role": "assistant", "content": assistant_response})
         except Exception as e:
             assistant_response = f"❌ Error: {str(e)}"
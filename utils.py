@@ -1,9 +1,17 @@
 import json
-import fitz
-import pandas as pd
 import os
 import hashlib
+import mmap
+import sqlite3
+import threading
+import queue
 import sys
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections import Counter
+from functools import lru_cache
+import numpy as np
+import orjson
 
 # Fix Windows console encoding for emojis
 if sys.platform == 'win32':
@@ -13,24 +21,166 @@ if sys.platform == 'win32':
     except:
         pass
 from langchain_text_splitters import CharacterTextSplitter, RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document as Doc
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_classic.memory import ConversationBufferWindowMemory
-from docx import Document as DocxDocument
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embedding wrapper that remembers query embeddings in memory and in a SQLite file,
+    so repeated or refined questions skip the encoder call. Chunk embeddings are kept in
+    the same file, so identical chunks (re-uploads, shared boilerplate) are encoded once.
+    """
+
+    def __init__(self, embedding_model, cache_path="embedding_cache.db", max_memory_entries=1024, model_id=None):
+        self.embedding_model = embedding_model
+        self.model_id = model_id or getattr(embedding_model, "model_name", "")
+        self.max_memory_entries = max_memory_entries
+        self._memory_cache = {}
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS query_embeddings (key BLOB PRIMARY KEY, embedding BLOB)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS document_embeddings (key BLOB PRIMARY KEY, embedding BLOB)"
+        )
+        self._connection.commit()
+
+    def _cache_key(self, text):
+        # Include the model id so switching models or backends never returns stale vectors
+        return hashlib.sha256(f"{self.model_id}\0{text}".encode("utf-8")).digest()
+
+    def _lookup_document_embeddings(self, keys):
+        found = {}
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ", ".join("?" * len(batch))
+            with self._lock:
+                rows = self._connection.execute(
+                    f"SELECT key, embedding FROM document_embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+            for key, embedding in rows:
+                found[key] = np.frombuffer(embedding, dtype=np.float32).tolist()
+        return found
+
+    def embed_documents(self, texts):
+        keys = [self._cache_key(text) for text in texts]
+        embeddings_by_key = self._lookup_document_embeddings(list(set(keys)))
+
+        # Encode each missing text once, even if it repeats within this batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in embeddings_by_key:
+                missing.setdefault(key, text)
+        if missing:
+            new_embeddings = self.embedding_model.embed_documents(list(missing.values()))
+            embeddings_by_key.update(zip(missing.keys(), new_embeddings))
+            with self._lock:
+                # One transaction, so an interrupted run never leaves partial rows
+                with self._connection:
+                    self._connection.executemany(
+                        "INSERT OR IGNORE INTO document_embeddings (key, embedding) VALUES (?, ?)",
+                        [(key, np.asarray(embedding, dtype=np.float32).tobytes())
+                         for key, embedding in zip(missing.keys(), new_embeddings)]
+                    )
+        return [embeddings_by_key[key] for key in keys]
+
+    def embed_query(self, text):
+        key = self._cache_key(text)
+        with self._lock:
+            if key in self._memory_cache:
+                return self._memory_cache[key]
+            row = self._connection.execute(
+                "SELECT embedding FROM query_embeddings WHERE key = ?", (key,)
+            ).fetchone()
+
+        if row:
+            embedding = np.frombuffer(row[0], dtype=np.float32).tolist()
+        else:
+            embedding = self.embedding_model.embed_query(text)
+
+        with self._lock:
+            if not row:
+                self._connection.execute(
+                    "INSERT OR IGNORE INTO query_embeddings (key, embedding) VALUES (?, ?)",
+                    (key, np.asarray(embedding, dtype=np.float32).tobytes())
+                )
+                self._connection.commit()
+            if len(self._memory_cache) >= self.max_memory_entries:
+                self._memory_cache.pop(next(iter(self._memory_cache)))
+            self._memory_cache[key] = embedding
+        return embedding
+
+def configure_torch_threads(num_threads):
+    """Use every core for intra-op parallelism in the CPU encoder; must run before torch is first used"""
+    # OpenMP/MKL read these when torch is first imported
+    os.environ.setdefault("OMP_NUM_THREADS", str(num_threads))
+    os.environ.setdefault("MKL_NUM_THREADS", str(num_threads))
+    import torch
+
+    torch.set_num_threads(num_threads)
+    try:
+        # One encode call at a time, so inter-op threads would only compete for cores
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # already fixed once torch has started parallel work
+    torch.backends.mkldnn.enabled = True
+
+@lru_cache(maxsize=1)
+def initialize_embedding_model(config_path="config.json"):
+    """
+    Load the embedding model once per process; every vectorstore load/build shares it.
+    Restart the app after changing embedding settings in config.
+    """
+    config = load_config(config_path)
+    if config.get("embedding_backend", "torch") == "torch":
+        configure_torch_threads(config.get("torch_num_threads", os.cpu_count() or 1))
+
+    # Imported here so sentence-transformers/torch load behind the startup spinner, not on first paint
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    model_name = "sentence-transformers/all-MiniLM-L6-v2"
+    model_kwargs = {'device': 'cpu'}
+    model_id = model_name
+
+    backend = config.get("embedding_backend", "torch")
+    if backend == "onnx":
+        # The model repo ships int8-quantized ONNX exports; the VNNI build runs the GEMMs as int8 dot products
+        onnx_file = config.get("onnx_model_file", "onnx/model_qint8_avx512_vnni.onnx")
+        model_kwargs['backend'] = "onnx"
+        model_kwargs['model_kwargs'] = {'file_name': onnx_file}
+        model_id = f"{model_name}:{onnx_file}"
+    elif backend != "torch":
+        raise ValueError(f"Unsupported embedding_backend in config: {backend}")
 
-def initialize_embedding_model():
     embedding_model = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2",
-        model_kwargs={'device': 'cpu'},
-        encode_kwargs={'normalize_embeddings': True}
+        model_name=model_name,
+        model_kwargs=model_kwargs,
+        encode_kwargs={
+            'normalize_embeddings': True,
+            # sentence-transformers length-sorts the texts before batching, so padding stays low;
+            # on CPU, batches of 64 beat larger ones that stop fitting in cache
+            'batch_size': config.get("embed_batch_size", 64)
+        }
+    )
+    return CachedEmbeddings(
+        embedding_model,
+        cache_path=config.get("embedding_cache_file", "embedding_cache.db"),
+        model_id=model_id
     )
-    return embedding_model
 
-def load_config(config_path="config.json"):
+@lru_cache(maxsize=4)
+def _read_config(config_path, mtime_ns):
     with open(config_path, 'r') as f:
         return json.load(f)
 
+def load_config(config_path="config.json"):
+    """Parsed config, shared between callers and re-read only when the file's mtime changes (treat as read-only)"""
+    return _read_config(config_path, os.stat(config_path).st_mtime_ns)
+
 def get_session_memory():
     # OPTION 1: Full session memory - keeps everything
     from langchain_classic.memory import ConversationBufferMemory
@@ -44,6 +194,7 @@ def get_session_memory():
 
 def get_session_memory_windowed():
     # OPTION 2: Window memory - keeps only last 10 exchanges (your old approach)
+    from langchain_classic.memory import ConversationBufferWindowMemory
     memory = ConversationBufferWindowMemory(
         k=10,
         memory_key="chat_history",
@@ -68,87 +219,445 @@ def get_session_memory_smart():
     )
     return memory
 
+_FILE_HASH_ALGORITHM = "blake2b"
+_MMAP_HASH_MIN_SIZE = 1 << 20
+
+def _digest_file(f, algorithm):
+    """Hash an open binary file; hashlib.file_digest reads it in C on Python 3.11+"""
+    if hasattr(hashlib, "file_digest"):
+        return hashlib.file_digest(f, algorithm)
+    digest = hashlib.new(algorithm)
+    buffer = bytearray(1 << 20)
+    view = memoryview(buffer)
+    while size := f.readinto(buffer):
+        digest.update(view[:size])
+    return digest
+
 def get_file_hash(file_path):
-    hash_md5 = hashlib.md5()
+    """
+    Content hash tagged with its algorithm ("blake2b:<hex>").
+    Files of 1 MB and more are hashed straight from a memory map, without Python-side read copies.
+    """
     with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+        if os.fstat(f.fileno()).st_size >= _MMAP_HASH_MIN_SIZE:
+            file_hash = hashlib.blake2b()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                file_hash.update(mapped)
+        else:
+            file_hash = _digest_file(f, _FILE_HASH_ALGORITHM)
+    return f"{_FILE_HASH_ALGORITHM}:{file_hash.hexdigest()}"
+
+def _get_legacy_md5_hash(file_path):
+    with open(file_path, "rb") as f:
+        return _digest_file(f, "md5").hexdigest()
+
+def file_hash_matches(file_path, stored_hash, file_hash):
+    """Compare a fresh hash with a manifest entry, checking untagged (MD5) entries from older versions"""
+    if stored_hash.startswith(f"{_FILE_HASH_ALGORITHM}:"):
+        return stored_hash == file_hash
+    return stored_hash == _get_legacy_md5_hash(file_path)
+
+# (file mtime, parsed manifest) from the last load or save; skips re-parsing an unchanged file
+_files_info_cache = None
+
+def _copy_files_info(files_info):
+    # Callers update entries before saving, so the cached manifest is never handed out directly
+    return {path: dict(info) for path, info in files_info.items()}
 
 def load_processed_files_info(config_path="config.json"):
+    global _files_info_cache
     info_file = "processed_files_info.json"
     if os.path.exists(info_file):
         try:
-            with open(info_file, 'r') as f:
-                return json.load(f)
+            mtime_ns = os.stat(info_file).st_mtime_ns
+            if _files_info_cache is None or _files_info_cache[0] != mtime_ns:
+                with open(info_file, 'rb') as f:
+                    _files_info_cache = (mtime_ns, orjson.loads(f.read()))
+            return _copy_files_info(_files_info_cache[1])
         except:
             pass
     return {}
 
 def save_processed_files_info(files_info, config_path="config.json"):
+    """Write the manifest atomically (temp file + rename), skipping the write if nothing changed"""
+    global _files_info_cache
     info_file = "processed_files_info.json"
     try:
-        with open(info_file, 'w') as f:
-            json.dump(files_info, f, indent=2)
+        if (_files_info_cache is not None and os.path.exists(info_file)
+                and os.stat(info_file).st_mtime_ns == _files_info_cache[0]
+                and _files_info_cache[1] == files_info):
+            return
+        temp_file = info_file + ".tmp"
+        with open(temp_file, 'wb') as f:
+            f.write(orjson.dumps(files_info, option=orjson.OPT_INDENT_2))
+        # A crash mid-write leaves the previous manifest intact
+        os.replace(temp_file, info_file)
+        _files_info_cache = (os.stat(info_file).st_mtime_ns, _copy_files_info(files_info))
     except Exception as e:
-        print(f"Error saving processed files info: {e}")
+        logger.error("Error saving processed files info: %s", e)
+
+# vectorstore path -> (index file mtime, loaded vectorstore); skips re-reading an unchanged index
+_VS_CACHE = {}
+
+def _get_index_mtime(vectorstore_path):
+    return os.stat(os.path.join(vectorstore_path, "index.faiss")).st_mtime_ns
+
+def _index_settings(index):
+    """(index_type, scalar_quantizer) an existing index was built with, as returned by _resolve_index_settings"""
+    import faiss
+
+    if hasattr(index, "nprobe"):
+        return "ivfpq", None
+    index_type = "hnsw" if hasattr(index, "hnsw") else "flat"
+    storage = faiss.downcast_index(index.storage) if index_type == "hnsw" else index
+    if not hasattr(storage, "sq"):
+        return index_type, None
+    quantizers = {faiss.ScalarQuantizer.QT_8bit: "sq8", faiss.ScalarQuantizer.QT_fp16: "fp16"}
+    return index_type, quantizers.get(storage.sq.qtype)
+
+def upgrade_index_if_large(vectorstore, config_path="config.json"):
+    """
+    Rebuild an index that fell back to exact storage (see create_faiss_index) as the configured
+    type once it holds enough chunks to train it. With "index_type": "auto", a flat index also
+    moves to the ANN index in "auto_index_type" (hnsw or ivfpq) once it holds more than
+    "ann_min_vectors" chunks. Vectors keep their positions, so docstore ids still match.
+    """
+    import faiss
+
+    index = vectorstore.index
+    if index.metric_type != faiss.METRIC_INNER_PRODUCT:
+        return  # Older L2 vector databases stay as built
+    config = load_config(config_path)
+    current_settings = _index_settings(index)
+    index_type = config.get("index_type", "flat")
+    is_auto = index_type == "auto"
+    if is_auto:
+        if current_settings[0] != "flat" or index.ntotal > config.get("ann_min_vectors", 50000):
+            index_type = config.get("auto_index_type", "hnsw")
+        else:
+            index_type = "flat"
+
+    target_settings = _resolve_index_settings(config, index.ntotal, index_type)
+    if target_settings == current_settings:
+        return
+    fallback_settings = _resolve_index_settings(config, None, index_type)
+    moving_to_ann = is_auto and current_settings[0] == "flat" and index_type != "flat"
+    if current_settings != fallback_settings and not moving_to_ann:
+        return  # Built with a different config; only fallbacks are upgraded
+
+    logger.info("%d chunks indexed - rebuilding index as %s", index.ntotal, index_type)
+    vectors = index.reconstruct_n(0, index.ntotal)
+    new_index = create_faiss_index(vectors.shape[1], config_path, num_vectors=len(vectors), index_type=index_type)
+    if not new_index.is_trained:
+        # A random sample is enough to learn clusters/codebooks and keeps training time bounded
+        sample_size = min(len(vectors), 100000)
+        sample = vectors[np.random.default_rng(0).choice(len(vectors), sample_size, replace=False)]
+        new_index.train(sample)
+    new_index.add(vectors)
+    vectorstore.index = new_index
+    vectorstore.distance_strategy = get_distance_strategy(new_index)
 
 def save_vectorstore(vectorstore, config_path="config.json"):
     vectorstore_path = "vectorstore"
     try:
+        upgrade_index_if_large(vectorstore, config_path)
         vectorstore.save_local(vectorstore_path)
-        print(f"Vectorstore saved to {vectorstore_path}")
+        _VS_CACHE[vectorstore_path] = (_get_index_mtime(vectorstore_path), vectorstore)
+        logger.info("Vectorstore saved to %s", vectorstore_path)
     except Exception as e:
-        print(f"Error saving vectorstore: {e}")
+        logger.error("Error saving vectorstore: %s", e)
 
 def load_vectorstore(config_path="config.json"):
+    from langchain_community.vectorstores import FAISS
+
     vectorstore_path = "vectorstore"
     if os.path.exists(vectorstore_path):
         try:
-            embedding_model = initialize_embedding_model()
+            index_mtime = _get_index_mtime(vectorstore_path)
+            cached = _VS_CACHE.get(vectorstore_path)
+            if cached and cached[0] == index_mtime:
+                return cached[1]
+            embedding_model = initialize_embedding_model(config_path)
             vectorstore = FAISS.load_local(vectorstore_path, embedding_model, allow_dangerous_deserialization=True)
-            print(f"Vectorstore loaded from {vectorstore_path}")
+            configure_index_search(vectorstore.index, config_path)
+            vectorstore.distance_strategy = get_distance_strategy(vectorstore.index)
+            _VS_CACHE[vectorstore_path] = (index_mtime, vectorstore)
+            logger.info("Vectorstore loaded from %s", vectorstore_path)
             return vectorstore
         except Exception as e:
-            print(f"Error loading vectorstore: {e}")
+            logger.error("Error loading vectorstore: %s", e)
     return None
 
+# Trained encodings learn their value ranges/codebooks from the vectors they are built with;
+# below these counts they rank badly, so exact storage is used until the corpus grows
+_MIN_IVFPQ_TRAINING_VECTORS = 256  # PQ codebooks need 256 training vectors
+_MIN_SQ8_TRAINING_VECTORS = 1000
+
+def _resolve_index_settings(config, num_vectors, index_type=None):
+    """(index_type, scalar_quantizer) to build for num_vectors, with "auto" and too-small corpora falling back to exact storage"""
+    index_type = index_type or config.get("index_type", "flat")
+    if index_type == "auto":
+        index_type = "flat"
+    if index_type == "ivfpq":
+        if num_vectors is None or num_vectors < _MIN_IVFPQ_TRAINING_VECTORS:
+            return "flat", None
+        return "ivfpq", None
+    scalar_quantizer = config.get("scalar_quantizer")
+    if scalar_quantizer == "sq8" and (num_vectors is None or num_vectors < _MIN_SQ8_TRAINING_VECTORS):
+        scalar_quantizer = None
+    return index_type, scalar_quantizer
+
+def create_faiss_index(dimension, config_path="config.json", num_vectors=None, index_type=None):
+    """
+    Create an empty FAISS index of the type set by "index_type" in config.
+    "flat" does exact search ("auto" starts flat; see upgrade_index_if_large); "hnsw" walks an HNSW graph so candidate gathering is ~log N.
+    "ivfpq" clusters vectors into inverted lists of product-quantized codes (smallest, fastest).
+    "scalar_quantizer": "sq8" stores vectors as int8 codes (4x smaller), "fp16" as half floats
+    (2x smaller, near-lossless), for flat or hnsw.
+    ivfpq and sq8 are trained on the vectors first added, so they need num_vectors and fall back
+    to unquantized storage for small corpora until upgrade_index_if_large rebuilds them.
+    Embeddings are L2-normalised, so every index ranks by inner product (= cosine similarity).
+    """
+    import faiss
+
+    config = load_config(config_path)
+    requested_type = index_type or config.get("index_type", "flat")
+    scalar_quantizer = config.get("scalar_quantizer")
+
+    quantizer_types = {"sq8": faiss.ScalarQuantizer.QT_8bit, "fp16": faiss.ScalarQuantizer.QT_fp16}
+    if scalar_quantizer and scalar_quantizer not in quantizer_types:
+        raise ValueError(f"Unsupported scalar_quantizer in config: {scalar_quantizer}")
+
+    index_type, effective_quantizer = _resolve_index_settings(config, num_vectors, requested_type)
+    if requested_type == "ivfpq" and index_type != "ivfpq":
+        logger.warning("Too few chunks (%s) to train an IVF-PQ index, using flat index until there are %d",
+                       num_vectors, _MIN_IVFPQ_TRAINING_VECTORS)
+    elif scalar_quantizer == "sq8" and effective_quantizer is None and requested_type != "ivfpq":
+        logger.warning("Too few chunks (%s) to train the sq8 quantizer, storing full vectors until there are %d",
+                       num_vectors, _MIN_SQ8_TRAINING_VECTORS)
+    quantizer_type = quantizer_types.get(effective_quantizer)
+    metric = faiss.METRIC_INNER_PRODUCT
+
+    if index_type == "ivfpq":
+        pq_m = config.get("pq_m", 48)
+        if dimension % pq_m:
+            raise ValueError(f"pq_m ({pq_m}) must divide the embedding dimension ({dimension})")
+        # IVF wants ~39 training vectors per list
+        nlist = max(1, min(config.get("ivf_nlist", 256), num_vectors // 39))
+        index = faiss.IndexIVFPQ(faiss.IndexFlatIP(dimension), dimension, nlist, pq_m, 8, metric)
+        # Hashtable direct map lets LangChain reconstruct vectors for MMR
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    elif index_type == "hnsw":
+        if quantizer_type is None:
+            index = faiss.IndexHNSWFlat(dimension, config.get("hnsw_m", 32), metric)
+        else:
+            index = faiss.IndexHNSWSQ(dimension, quantizer_type, config.get("hnsw_m", 32), metric)
+    elif index_type == "flat":
+        if quantizer_type is None:
+            index = faiss.IndexFlatIP(dimension)
+        else:
+            index = faiss.IndexScalarQuantizer(dimension, quantizer_type, metric)
+    else:
+        raise ValueError(f"Unsupported index_type in config: {index_type}")
+
+    configure_index_search(index, config_path)
+    return index
+
+def configure_index_search(index, config_path="config.json"):
+    """Apply search-time parameters from config to a freshly built or loaded index"""
+    if hasattr(index, "hnsw"):
+        config = load_config(config_path)
+        index.hnsw.efSearch = config.get("hnsw_ef_search", 64)
+    elif hasattr(index, "nprobe"):
+        config = load_config(config_path)
+        index.nprobe = config.get("ivf_nprobe", 16)
+
+def get_distance_strategy(index):
+    """LangChain distance strategy matching the index metric (older vector databases use L2)"""
+    import faiss
+    from langchain_community.vectorstores.utils import DistanceStrategy
+
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return DistanceStrategy.MAX_INNER_PRODUCT
+    return DistanceStrategy.EUCLIDEAN_DISTANCE
+
+def build_vectorstore(doc_chunks, config_path="config.json", vectorstore=None):
+    """Embed all chunks in one batched call and add them to the given vectorstore, or to a new one"""
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+
+    if vectorstore is not None:
+        embedding_model = vectorstore.embeddings
+    else:
+        embedding_model = initialize_embedding_model(config_path)
+    texts = [chunk.page_content for chunk in doc_chunks]
+    embeddings = embedding_model.embed_documents(texts)
+
+    if vectorstore is None:
+        index = create_faiss_index(len(embeddings[0]), config_path, num_vectors=len(embeddings))
+        if not index.is_trained:
+            # Only built when the first batch is large enough to learn value ranges (and IVF clusters) from
+            index.train(np.asarray(embeddings, dtype=np.float32))
+
+        vectorstore = FAISS(
+            embedding_function=embedding_model,
+            index=index,
+            docstore=InMemoryDocstore(),
+            index_to_docstore_id={},
+            distance_strategy=get_distance_strategy(index)
+        )
+    ids = vectorstore.add_embeddings(
+        zip(texts, embeddings),
+        metadatas=[chunk.metadata for chunk in doc_chunks]
+    )
+    return vectorstore, ids
+
+def group_chunk_ids_by_file(doc_chunks, ids):
+    """Map each source file path to the docstore ids of its chunks"""
+    chunk_ids = {}
+    for chunk, doc_id in zip(doc_chunks, ids):
+        chunk_ids.setdefault(chunk.metadata.get("file_path"), []).append(doc_id)
+    return chunk_ids
+
+def copy_vectorstore(vectorstore):
+    """
+    Copy of a vectorstore with its own index, docstore and id map. Updates are made on a copy and
+    swapped in whole, since FAISS cannot add or remove vectors while another session searches it.
+    """
+    import copy
+    import faiss
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+
+    vectorstore_copy = copy.copy(vectorstore)
+    vectorstore_copy.index = faiss.clone_index(vectorstore.index)
+    vectorstore_copy.docstore = InMemoryDocstore(dict(vectorstore.docstore._dict))
+    vectorstore_copy.index_to_docstore_id = dict(vectorstore.index_to_docstore_id)
+    return vectorstore_copy
+
+def _rebuild_without_chunks(vectorstore, chunk_ids):
+    """
+    Drop chunks from an HNSW or IVF index by re-adding the survivors to an emptied copy of it.
+    HNSW cannot remove vectors at all, and IVF keeps each vector's original id on remove_ids
+    while LangChain renumbers its id map to 0..n-1, so searches would hit missing positions.
+    The copy keeps trained quantizers, clusters and codebooks, so nothing is retrained.
+    """
+    import faiss
+
+    removed = set(chunk_ids)
+    index = vectorstore.index
+    id_map = vectorstore.index_to_docstore_id
+    keep = [position for position in range(index.ntotal) if id_map[position] not in removed]
+    vectors = index.reconstruct_n(0, index.ntotal)[keep]
+    new_index = faiss.clone_index(index)
+    new_index.reset()
+    if keep:
+        new_index.add(vectors)
+    vectorstore.index = new_index
+    vectorstore.index_to_docstore_id = {i: id_map[position] for i, position in enumerate(keep)}
+    vectorstore.docstore.delete([doc_id for doc_id in id_map.values() if doc_id in removed])
+
+def get_file_chunk_ids(vectorstore, file_path, file_info):
+    """Docstore ids of a file's chunks, plus older chunks of it that could not be removed yet"""
+    chunk_ids = file_info.get("chunk_ids")
+    if chunk_ids is None:
+        # Entries written before chunk ids were tracked: find the chunks by their source path
+        chunk_ids = [
+            doc_id for doc_id in vectorstore.index_to_docstore_id.values()
+            if getattr(vectorstore.docstore.search(doc_id), "metadata", {}).get("file_path") == file_path
+        ]
+    return chunk_ids + file_info.get("stale_chunk_ids", [])
+
+def remove_chunks(vectorstore, chunk_ids):
+    """Delete chunks from the vectorstore in one pass. Returns False if they could not be removed."""
+    # Ids already gone (e.g. removed by an earlier retry) would make FAISS.delete raise
+    indexed_ids = set(vectorstore.index_to_docstore_id.values())
+    chunk_ids = [doc_id for doc_id in chunk_ids if doc_id in indexed_ids]
+    if not chunk_ids:
+        return True
+    try:
+        if hasattr(vectorstore.index, "hnsw") or hasattr(vectorstore.index, "nprobe"):
+            _rebuild_without_chunks(vectorstore, chunk_ids)
+        else:
+            vectorstore.delete(ids=chunk_ids)
+        return True
+    except Exception as e:
+        logger.warning("Could not remove %d old chunks: %s", len(chunk_ids), e)
+        return False
+
+def get_file_stat_info(file_path, stat=None):
+    """Cheap change signature for a file, compared before falling back to hashing"""
+    if stat is None:
+        stat = os.stat(file_path)
+    return {"mtime": stat.st_mtime, "size": stat.st_size}
+
+SUPPORTED_EXTENSIONS = frozenset(['.pdf', '.docx', '.csv', '.xlsx', '.txt'])
+
+def iter_supported_files(folder, skipped_folders=None):
+    """
+    Yield os.DirEntry objects for supported documents under folder, without following directory symlinks.
+    Folders that cannot be listed (no permission, removed during the walk) are logged and skipped,
+    and appended to skipped_folders when a list is passed.
+    """
+    try:
+        with os.scandir(folder) as scanner:
+            entries = list(scanner)
+    except OSError as e:
+        logger.warning("Skipping folder %s: %s", folder, e)
+        if skipped_folders is not None:
+            skipped_folders.append(folder)
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from iter_supported_files(entry.path, skipped_folders)
+        # Filter on the name before any stat or hashing work
+        elif os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTENSIONS and entry.is_file():
+            yield entry
+
 def extract_text_from_file_path(file_path):
     """Extract plain text from a file given its path. Only paragraphs from DOCX, selectable text from PDF, and plain text from TXT, CSV, XLSX."""
     file_type = file_path.split(".")[-1].lower()
     text = ""
 
+    if file_type == "docx":
+        from docx import Document as DocxDocument
+    elif file_type == "pdf":
+        import fitz
+    elif file_type in ["csv", "xlsx"]:
+        import pandas as pd
+
     if file_type == "docx":
         try:
             doc = DocxDocument(file_path)
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
+            # Build once from a list; repeated += copies the whole string on each paragraph
+            text = "".join([paragraph.text + "\n" for paragraph in doc.paragraphs])
         except Exception as e:
-            print(f"Error reading DOCX file {file_path}: {e}")
+            logger.error("Error reading DOCX file %s: %s", file_path, e)
 
     elif file_type == "pdf":
         try:
             with fitz.open(file_path) as pdf:
-                for page in pdf:
-                    text += page.get_text()
+                # Plain "text" mode skips building layout blocks; join once instead of growing a string
+                text = "".join(page.get_text("text", sort=False) for page in pdf)
         except Exception as e:
-            print(f"Error reading PDF file {file_path}: {e}")
+            logger.error("Error reading PDF file %s: %s", file_path, e)
 
     elif file_type in ["csv", "xlsx"]:
         try:
+            # Read every cell as a string (no dtype inference) and emit tab-separated rows:
+            # linear in the number of cells, with none of to_string()'s column padding
             if file_type == "csv":
-                df = pd.read_csv(file_path, encoding='utf-8')
+                df = pd.read_csv(file_path, encoding='utf-8', dtype=str, na_filter=False)
             else:
-                df = pd.read_excel(file_path)
-            text = df.to_string()
+                df = pd.read_excel(file_path, engine='openpyxl', dtype=str, na_filter=False)
+            text = df.to_csv(sep='\t', index=False)
         except Exception as e:
-            print(f"Error reading {file_type} file {file_path}: {e}")
+            logger.error("Error reading %s file %s: %s", file_type, file_path, e)
             if file_type == "csv":
                 try:
-                    df = pd.read_csv(file_path, encoding='latin-1')
-                    text = df.to_string()
+                    df = pd.read_csv(file_path, encoding='latin-1', dtype=str, na_filter=False)
+                    text = df.to_csv(sep='\t', index=False)
                 except:
-                    print(f"Could not read CSV file {file_path} with any encoding")
+                    logger.error("Could not read CSV file %s with any encoding", file_path)
 
     elif file_type == "txt":
         try:
@@ -161,15 +670,40 @@ def extract_text_from_file_path(file_path):
                 except UnicodeDecodeError:
                     continue
         except Exception as e:
-            print(f"Error reading text file {file_path}: {e}")
+            logger.error("Error reading text file %s: %s", file_path, e)
 
     else:
-        print(f"Unsupported file type: {file_type}")
+        logger.warning("Unsupported file type: %s", file_type)
 
     return text
 
-def process_uploaded_files(uploaded_files, config_path="config.json"):
-    """Process uploaded files by saving them to sop_documents folder and adding to vectorstore"""
+def extract_texts_parallel(file_paths, progress_callback=None):
+    """Extract text from many files in a process pool, returning {file_path: text}"""
+    texts = {}
+    if not file_paths:
+        return texts
+    
+    max_workers = min(len(file_paths), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(extract_text_from_file_path, path): path for path in file_paths}
+        for completed, future in enumerate(as_completed(futures), start=1):
+            file_path = futures[future]
+            try:
+                texts[file_path] = future.result()
+            except Exception as e:
+                logger.error("Error processing file %s: %s", file_path, e)
+                texts[file_path] = ""
+            if progress_callback:
+                progress_callback(completed, len(file_paths))
+    return texts
+
+def process_uploaded_files(uploaded_files, config_path="config.json", progress_callback=None, vectorstore=None):
+    """
+    Process uploaded files by saving them to sop_documents folder and adding to vectorstore.
+    Pass the in-memory vectorstore to start from it instead of loading it from disk; it is never
+    modified, the changes go into a copy that is returned.
+    Returns (processed_count, vectorstore, processing_info); processing_info is None if nothing was added.
+    """
     config = load_config(config_path)
     documents_folder = config.get("documents_folder", "sop_documents")
     
@@ -177,6 +711,9 @@ def process_uploaded_files(uploaded_files, config_path="config.json"):
     if not os.path.exists(documents_folder):
         os.makedirs(documents_folder)
     
+    # Load existing vectorstore or create new one
+    existing_vectorstore = vectorstore if vectorstore is not None else load_vectorstore(config_path)
+    
     saved_files = []
     processed_documents = []
     
@@ -190,155 +727,257 @@ def process_uploaded_files(uploaded_files, config_path="config.json"):
                 f.write(uploaded_file.getbuffer())
             
             saved_files.append(file_path)
-            print(f"✅ Saved: {uploaded_file.name}")
-            
-            # Extract text from the saved file
-            document_text = extract_text_from_file_path(file_path)
-            
-            if document_text.strip():
-                # Create document object
-                doc = Doc(
-                    page_content=document_text,
-                    metadata={
-                        "source": uploaded_file.name,
-                        "file_path": file_path,
-                        "file_type": os.path.splitext(uploaded_file.name)[1].lower(),
-                        "folder": ""
-                    }
-                )
-                processed_documents.append(doc)
-                print(f"✅ Processed: {uploaded_file.name}")
-            else:
-                print(f"⚠️ No text extracted from: {uploaded_file.name}")
-                
+            logger.info("Saved: %s", uploaded_file.name)
         except Exception as e:
-            print(f"❌ Error processing {uploaded_file.name}: {e}")
+            logger.error("Error saving %s: %s", uploaded_file.name, e)
             continue
     
+    # Parse the saved files across all cores; parsing is CPU-bound and dominates bulk uploads
+    extracted_texts = extract_texts_parallel(saved_files, progress_callback)
+    
+    for file_path in saved_files:
+        file_name = os.path.basename(file_path)
+        document_text = extracted_texts.get(file_path, "")
+        if document_text.strip():
+            # Create document object
+            doc = Doc(
+                page_content=document_text,
+                metadata={
+                    "source": file_name,
+                    "file_path": file_path,
+                    "file_type": os.path.splitext(file_name)[1].lower(),
+                    "folder": ""
+                }
+            )
+            processed_documents.append(doc)
+            logger.info("Processed: %s", file_name)
+        else:
+            logger.warning("No text extracted from: %s", file_name)
+    
     # Add documents to vectorstore if any were processed
     if processed_documents:
-        print(f"Adding {len(processed_documents)} documents to vectorstore...")
+        logger.info("Adding %d documents to vectorstore...", len(processed_documents))
         
         # Use optimized chunking strategy for large documents
-        print("🔄 Creating optimized chunks...")
+        logger.info("Creating optimized chunks...")
         doc_chunks = create_optimized_chunks_for_large_docs(processed_documents, config_path)
         
-        # Load existing vectorstore or create new one
-        existing_vectorstore = load_vectorstore(config_path)
+        processed_files_info = load_processed_files_info(config_path)
+        
+        # Other sessions may be searching the current vectorstore, so change a copy
+        if existing_vectorstore:
+            existing_vectorstore = copy_vectorstore(existing_vectorstore)
+        
+        # Re-uploading a file replaces its previous chunks
+        replaced_files = [path for path in saved_files if path in processed_files_info]
+        stale_chunk_ids = {}
+        if existing_vectorstore and replaced_files:
+            stale_chunk_ids = {
+                path: get_file_chunk_ids(existing_vectorstore, path, processed_files_info[path])
+                for path in replaced_files
+            }
+            if remove_chunks(existing_vectorstore, [doc_id for ids in stale_chunk_ids.values() for doc_id in ids]):
+                stale_chunk_ids = {}
         
+        # Chunks from every uploaded file are embedded together in one batched call
+        final_vectorstore, chunk_ids = build_vectorstore(doc_chunks, config_path, existing_vectorstore)
         if existing_vectorstore:
-            # Add to existing vectorstore
-            existing_vectorstore.add_documents(doc_chunks)
-            final_vectorstore = existing_vectorstore
-            print("Added documents to existing vectorstore")
+            logger.info("Added documents to existing vectorstore")
         else:
-            # Create new vectorstore
-            embedding_model = initialize_embedding_model()
-            final_vectorstore = FAISS.from_documents(doc_chunks, embedding_model)
-            print("Created new vectorstore")
+            logger.info("Created new vectorstore")
         
         # Save vectorstore
         save_vectorstore(final_vectorstore, config_path)
         
         # Update processed files info
-        processed_files_info = load_processed_files_info(config_path)
+        chunk_ids_by_file = group_chunk_ids_by_file(doc_chunks, chunk_ids)
         for file_path in saved_files:
             file_hash = get_file_hash(file_path)
             processed_files_info[file_path] = {
                 "hash": file_hash,
                 "name": os.path.basename(file_path),
                 "extension": os.path.splitext(file_path)[1].lower(),
-                "folder": ""
+                "folder": "",
+                **get_file_stat_info(file_path),
+                "chunk_ids": chunk_ids_by_file.get(file_path, [])
             }
+            if stale_chunk_ids.get(file_path):
+                # Removal failed: keep the old ids so the next refresh retries it
+                processed_files_info[file_path]["stale_chunk_ids"] = stale_chunk_ids[file_path]
         save_processed_files_info(processed_files_info, config_path)
         
-        return len(processed_documents), final_vectorstore
+        # The manifest already lists every indexed file, so no folder rescan is needed
+        total_docs = len(processed_files_info)
+        processing_info = {
+            "total_documents": total_docs,
+            "new_documents": len(processed_documents),
+            "reused_documents": total_docs - len(processed_documents),
+            # Counted from the manifest so removals still pending from earlier runs are reported too
+            "pending_removals": sum(1 for info in processed_files_info.values() if info.get("stale_chunk_ids"))
+        }
+        return len(processed_documents), final_vectorstore, processing_info
     
-    return 0, load_vectorstore(config_path)
+    return 0, existing_vectorstore, None
 
-def load_documents_from_folder_incremental(config_path="config.json"):
+def load_documents_from_folder_incremental(config_path="config.json", vectorstore=None):
+    """
+    Sync the vectorstore with the documents folder. Only new or changed files are parsed and
+    embedded, and chunks of changed or deleted files are removed. Pass the in-memory
+    vectorstore to start from it instead of reloading it from disk; it is never modified,
+    the changes go into a copy that is returned.
+    """
     config = load_config(config_path)
     documents_folder = config.get("documents_folder", "sop_documents")
     if not os.path.exists(documents_folder):
-        print(f"Documents folder '{documents_folder}' not found. Creating it...")
+        logger.warning("Documents folder '%s' not found. Creating it...", documents_folder)
         os.makedirs(documents_folder)
-        print(f"Please add your documents to the '{documents_folder}' folder")
+        logger.warning("Please add your documents to the '%s' folder", documents_folder)
         return [], None, {}
-    existing_vectorstore = load_vectorstore(config_path)
+    existing_vectorstore = vectorstore if vectorstore is not None else load_vectorstore(config_path)
     processed_files_info = load_processed_files_info(config_path)
     current_files = {}
-    supported_extensions = ['.pdf', '.docx', '.csv', '.xlsx', '.txt']
-    for root, dirs, files in os.walk(documents_folder):
-        for file in files:
-            file_path = os.path.join(root, file)
-            file_ext = os.path.splitext(file)[1].lower()
-            if file_ext in supported_extensions:
-                try:
-                    file_hash = get_file_hash(file_path)
+    new_or_changed_files = []
+    files_to_hash = {}
+    skipped_folders = []
+    for entry in iter_supported_files(documents_folder, skipped_folders):
+        file_path = entry.path
+        try:
+            stat_info = get_file_stat_info(file_path, entry.stat())
+            previous_info = processed_files_info.get(file_path)
+            # Unchanged mtime and size: trust the manifest and skip hashing the file
+            if (previous_info and previous_info.get("mtime") == stat_info["mtime"]
+                    and previous_info.get("size") == stat_info["size"]):
+                current_files[file_path] = previous_info
+                continue
+            files_to_hash[file_path] = {
+                "name": entry.name,
+                "extension": os.path.splitext(entry.name)[1].lower(),
+                "folder": os.path.relpath(os.path.dirname(file_path), documents_folder),
+                **stat_info
+            }
+        except Exception as e:
+            logger.error("Error processing file metadata for %s: %s", file_path, e)
+            if file_path in processed_files_info:
+                # Unreadable for now: keep the indexed version rather than treating it as deleted
+                current_files[file_path] = processed_files_info[file_path]
+    
+    # Files under folders that could not be listed are unreachable for now, not deleted
+    for skipped_folder in skipped_folders:
+        skipped_prefix = os.path.join(skipped_folder, "")
+        for file_path, file_info in processed_files_info.items():
+            if file_path.startswith(skipped_prefix):
+                current_files[file_path] = file_info
+    
+    # Hash the remaining files concurrently; hashlib releases the GIL while digesting
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) + 4)) as executor:
+        hash_futures = {executor.submit(get_file_hash, path): path for path in files_to_hash}
+        for future in as_completed(hash_futures):
+            file_path = hash_futures[future]
+            try:
+                file_hash = future.result()
+            except Exception as e:
+                logger.error("Error processing file metadata for %s: %s", file_path, e)
+                if file_path in processed_files_info:
+                    # Unreadable for now: keep the indexed version rather than treating it as deleted
+                    current_files[file_path] = processed_files_info[file_path]
+                continue
+            current_files[file_path] = {"hash": file_hash, **files_to_hash[file_path]}
+            previous_info = processed_files_info.get(file_path)
+            if previous_info and file_hash_matches(file_path, previous_info["hash"], file_hash):
+                # Touched but identical content: keep the existing chunks and any pending removals
+                for key in ("chunk_ids", "stale_chunk_ids"):
+                    if key in previous_info:
+                        current_files[file_path][key] = previous_info[key]
+            else:
+                new_or_changed_files.append(file_path)
+    
+    # Keep a stable document order regardless of which hash finished first
+    new_or_changed_files.sort()
+    
+    # Drop chunks of deleted files and of files about to be re-embedded, plus any earlier
+    # chunks whose removal failed, in a single pass over the index
+    deleted_files = [path for path in processed_files_info if path not in current_files]
+    stale_files = deleted_files + [path for path in new_or_changed_files if path in processed_files_info]
+    stale_chunk_ids = {}
+    if existing_vectorstore:
+        stale_chunk_ids = {
+            path: get_file_chunk_ids(existing_vectorstore, path, processed_files_info[path])
+            for path in stale_files
+        }
+        for file_path, file_info in current_files.items():
+            if file_info.get("stale_chunk_ids") and file_path not in stale_chunk_ids:
+                stale_chunk_ids[file_path] = file_info["stale_chunk_ids"]
+        stale_chunk_ids = {path: ids for path, ids in stale_chunk_ids.items() if ids}
+    # Other sessions may be searching the current vectorstore, so change a copy
+    if existing_vectorstore and (stale_chunk_ids or new_or_changed_files):
+        existing_vectorstore = copy_vectorstore(existing_vectorstore)
+    chunks_removed = False
+    if stale_chunk_ids:
+        logger.info("Removing chunks of %d deleted/changed documents...", len(stale_chunk_ids))
+        if remove_chunks(existing_vectorstore, [doc_id for ids in stale_chunk_ids.values() for doc_id in ids]):
+            for file_path in stale_chunk_ids:
+                if file_path in current_files:
                     current_files[file_path] = {
-                        "hash": file_hash,
-                        "name": file,
-                        "extension": file_ext,
-                        "folder": os.path.relpath(root, documents_folder)
+                        key: value for key, value in current_files[file_path].items() if key != "stale_chunk_ids"
                     }
-                except Exception as e:
-                    print(f"Error processing file metadata for {file_path}: {e}")
-    new_or_changed_files = []
-    for file_path, file_info in current_files.items():
-        if (file_path not in processed_files_info or 
-            processed_files_info[file_path]["hash"] != file_info["hash"]):
-            new_or_changed_files.append(file_path)
+            stale_chunk_ids = {}
+            chunks_removed = True
+    
     new_documents = []
     if new_or_changed_files:
-        print(f"Processing {len(new_or_changed_files)} new/changed documents...")
+        logger.info("Processing %d new/changed documents...", len(new_or_changed_files))
+        # Parse across all cores, then build the documents in the main process
+        extracted_texts = extract_texts_parallel(new_or_changed_files)
         for file_path in new_or_changed_files:
-            try:
-                print(f"Processing: {file_path}")
-                document_text = extract_text_from_file_path(file_path)
-                if document_text.strip():
-                    file_info = current_files[file_path]
-                    doc = Doc(
-                        page_content=document_text,
-                        metadata={
-                            "source": file_info["name"],
-                            "file_path": file_path,
-                            "file_type": file_info["extension"],
-                            "folder": file_info["folder"]
-                        }
-                    )
-                    new_documents.append(doc)
-                    print(f"✅ Successfully processed: {file_info['name']}")
-                else:
-                    print(f"⚠️ No text extracted from: {file_path}")
-            except Exception as e:
-                print(f"❌ Error processing file {file_path}: {e}")
-                continue
+            document_text = extracted_texts.get(file_path, "")
+            if document_text.strip():
+                file_info = current_files[file_path]
+                doc = Doc(
+                    page_content=document_text,
+                    metadata={
+                        "source": file_info["name"],
+                        "file_path": file_path,
+                        "file_type": file_info["extension"],
+                        "folder": file_info["folder"]
+                    }
+                )
+                new_documents.append(doc)
+                logger.info("Successfully processed: %s", file_info['name'])
+            else:
+                logger.warning("No text extracted from: %s", file_path)
     if new_documents:
-        print(f"Adding {len(new_documents)} new documents to vectorstore...")
+        logger.info("Adding %d new documents to vectorstore...", len(new_documents))
         # Use optimized chunking strategy for large documents
-        print("🔄 Creating optimized chunks...")
+        logger.info("Creating optimized chunks...")
         new_doc_chunks = create_optimized_chunks_for_large_docs(new_documents, config_path)
+        final_vectorstore, chunk_ids = build_vectorstore(new_doc_chunks, config_path, existing_vectorstore)
         if existing_vectorstore:
-            embedding_model = initialize_embedding_model()
-            existing_vectorstore.add_documents(new_doc_chunks)
-            final_vectorstore = existing_vectorstore
-            print("Added new documents to existing vectorstore")
+            logger.info("Added new documents to existing vectorstore")
         else:
-            embedding_model = initialize_embedding_model()
-            final_vectorstore = FAISS.from_documents(new_doc_chunks, embedding_model)
-            print("Created new vectorstore")
-        save_vectorstore(final_vectorstore, config_path)
-        processed_files_info.update(current_files)
-        save_processed_files_info(processed_files_info, config_path)
+            logger.info("Created new vectorstore")
+        for file_path, ids in group_chunk_ids_by_file(new_doc_chunks, chunk_ids).items():
+            current_files[file_path]["chunk_ids"] = ids
     else:
-        print("No new or changed documents found.")
+        logger.info("No new or changed documents found.")
         final_vectorstore = existing_vectorstore
+    if final_vectorstore and (new_documents or chunks_removed):
+        save_vectorstore(final_vectorstore, config_path)
     total_docs = len(current_files)
+    # Chunks that could not be removed stay listed in the manifest so the next refresh retries them
+    for file_path, chunk_ids in stale_chunk_ids.items():
+        if file_path in current_files:
+            current_files[file_path] = {**current_files[file_path], "stale_chunk_ids": chunk_ids}
+        else:
+            current_files[file_path] = {**processed_files_info[file_path], "chunk_ids": [], "stale_chunk_ids": chunk_ids}
+    if current_files != processed_files_info:
+        save_processed_files_info(current_files, config_path)
     new_docs = len(new_documents)
     processing_info = {
         "total_documents": total_docs,
         "new_documents": new_docs,
-        "reused_documents": total_docs - new_docs
+        "reused_documents": total_docs - new_docs,
+        "removed_documents": len([path for path in deleted_files if path not in stale_chunk_ids]),
+        "pending_removals": sum(1 for info in current_files.values() if info.get("stale_chunk_ids"))
     }
     return new_documents, final_vectorstore, processing_info
 
@@ -354,37 +993,77 @@ def clear_vectorstore_and_cache(config_path="config.json"):
         try:
             import shutil
             shutil.rmtree(vectorstore_path)
+            _VS_CACHE.pop(vectorstore_path, None)
             cleared_items.append("Vector database (FAISS index)")
-            print(f"✅ Cleared vector database from {vectorstore_path}")
+            logger.info("Cleared vector database from %s", vectorstore_path)
         except Exception as e:
-            print(f"❌ Error clearing vector database: {e}")
+            logger.error("Error clearing vector database: %s", e)
     
     # Clear processed files info
     if os.path.exists(processed_files_info_path):
         try:
             # Create empty processed files info
-            with open(processed_files_info_path, 'w') as f:
-                json.dump({}, f, indent=2)
+            with open(processed_files_info_path, 'wb') as f:
+                f.write(orjson.dumps({}))
             cleared_items.append("Processed files cache")
-            print(f"✅ Cleared processed files cache")
+            logger.info("Cleared processed files cache")
         except Exception as e:
-            print(f"❌ Error clearing processed files info: {e}")
+            logger.error("Error clearing processed files info: %s", e)
     
     if cleared_items:
-        print(f"\n🎯 Successfully cleared: {', '.join(cleared_items)}")
-        print("💡 You can now add new documents - they will be processed fresh!")
+        logger.info("Successfully cleared: %s. New documents will be processed fresh.", ", ".join(cleared_items))
         return True
     else:
-        print("ℹ️ No vector database or cache found to clear")
+        logger.info("No vector database or cache found to clear")
         return False
 
+# Splitters are stateless, so one instance of each is shared by every document and upload.
+# Large documents (50k+ chars): one tier only; each extra tier re-embedded the whole document,
+# and large documents dominate indexing time. Overlapping windows keep the context.
+_LARGE_DOC_SPLITTER = RecursiveCharacterTextSplitter(
+    separators=["\n\n\n", "\n\n", "\n", ". ", ", ", " "],
+    chunk_size=1500,
+    chunk_overlap=200,
+    length_function=len
+)
+
+# Medium documents (5k-50k chars): standard (1800) and detailed (1000) tiers
+_MEDIUM_DOC_SPLITTERS = [
+    ("standard", RecursiveCharacterTextSplitter(
+        separators=["\n\n\n", "\n\n", "\n", ". ", ", ", " "],
+        chunk_size=1800,
+        chunk_overlap=250,
+        length_function=len
+    )),
+    ("detailed", RecursiveCharacterTextSplitter(
+        separators=["\n\n", "\n", ". ", ", ", " "],
+        chunk_size=1000,
+        chunk_overlap=150,
+        length_function=len
+    ))
+]
+
+# Small documents (under 5k chars)
+_SMALL_DOC_SPLITTER = RecursiveCharacterTextSplitter(
+    separators=["\n\n\n", "\n\n", "\n", ". ", "; ", ", ", " "],
+    chunk_size=1000,
+    chunk_overlap=150,
+    length_function=len
+)
+
+# Fallback when a small document still comes out as a single chunk
+_AGGRESSIVE_SPLITTER = RecursiveCharacterTextSplitter(
+    separators=["\n", ". ", "; ", ", ", " ", ""],
+    chunk_size=800,
+    chunk_overlap=100,
+    length_function=len
+)
+
 def create_optimized_chunks_for_large_docs(documents, config_path="config.json"):
     """
     Improved chunking strategy that works well for documents of all sizes
     Uses intelligent splitting with multiple fallback separators
     """
-    from langchain_text_splitters import RecursiveCharacterTextSplitter
-    
     # Load config
     config = load_config(config_path)
     
@@ -396,75 +1075,30 @@ def create_optimized_chunks_for_large_docs(documents, config_path="config.json")
         
         # Check document size
         doc_size = len(doc_text)
-        print(f"Processing document: {doc_metadata.get('source', 'Unknown')} ({doc_size:,} characters)")
+        logger.info("Processing document: %s (%s characters)", doc_metadata.get('source', 'Unknown'), f"{doc_size:,}")
         
         if doc_size > 50000:  # Large document (50k+ chars)
-            print("🔍 Large document detected - using multi-tier chunking strategy")
+            logger.info("Large document detected - using single-tier chunking")
             
-            # Multi-tier chunking for large documents
-            splitters = [
-                # Large chunks for broad context (4000 chars)
-                RecursiveCharacterTextSplitter(
-                    separators=["\n\n\n\n", "\n\n\n", "\n\n", "\n", ". ", ", ", " "],
-                    chunk_size=4000,
-                    chunk_overlap=400,
-                    length_function=len
-                ),
-                # Medium chunks for detailed content (2000 chars)
-                RecursiveCharacterTextSplitter(
-                    separators=["\n\n\n", "\n\n", "\n", ". ", ", ", " "],
-                    chunk_size=2000,
-                    chunk_overlap=300,
-                    length_function=len
-                ),
-                # Small chunks for specific details (1200 chars)
-                RecursiveCharacterTextSplitter(
-                    separators=["\n\n", "\n", ". ", ", ", " "],
-                    chunk_size=1200,
-                    chunk_overlap=200,
-                    length_function=len
-                )
-            ]
+            chunks = _LARGE_DOC_SPLITTER.split_documents([doc])
             
-            for i, splitter in enumerate(splitters):
-                chunk_type = ["broad", "detailed", "specific"][i]
-                chunks = splitter.split_documents([doc])
-                
-                for j, chunk in enumerate(chunks):
-                    enhanced_metadata = {
-                        **doc_metadata,
-                        "chunk_type": chunk_type,
-                        "chunk_index": j,
-                        "total_chunks": len(chunks),
-                        "doc_size_category": "large",
-                        "chunk_size": len(chunk.page_content)
-                    }
-                    chunk.metadata = enhanced_metadata
-                    all_chunks.append(chunk)
+            for j, chunk in enumerate(chunks):
+                enhanced_metadata = {
+                    **doc_metadata,
+                    "chunk_type": "standard",
+                    "chunk_index": j,
+                    "total_chunks": len(chunks),
+                    "doc_size_category": "large",
+                    "chunk_size": len(chunk.page_content)
+                }
+                chunk.metadata = enhanced_metadata
+                all_chunks.append(chunk)
                     
         elif doc_size > 5000:  # Medium document (5k-50k chars)
-            print("📄 Medium document - using dual-tier chunking")
+            logger.info("Medium document - using dual-tier chunking")
             
             # Dual-tier chunking for medium documents
-            splitters = [
-                # Standard chunks (1800 chars)
-                RecursiveCharacterTextSplitter(
-                    separators=["\n\n\n", "\n\n", "\n", ". ", ", ", " "],
-                    chunk_size=1800,
-                    chunk_overlap=250,
-                    length_function=len
-                ),
-                # Detailed chunks (1000 chars)
-                RecursiveCharacterTextSplitter(
-                    separators=["\n\n", "\n", ". ", ", ", " "],
-                    chunk_size=1000,
-                    chunk_overlap=150,
-                    length_function=len
-                )
-            ]
-            
-            for i, splitter in enumerate(splitters):
-                chunk_type = ["standard", "detailed"][i]
+            for chunk_type, splitter in _MEDIUM_DOC_SPLITTERS:
                 chunks = splitter.split_documents([doc])
                 
                 for j, chunk in enumerate(chunks):
@@ -480,28 +1114,15 @@ def create_optimized_chunks_for_large_docs(documents, config_path="config.json")
                     all_chunks.append(chunk)
                     
         else:  # Small document (under 5k chars)
-            print("📋 Small document - using optimized single-tier chunking")
+            logger.info("Small document - using optimized single-tier chunking")
             
             # Smart chunking for small documents
-            splitter = RecursiveCharacterTextSplitter(
-                separators=["\n\n\n", "\n\n", "\n", ". ", "; ", ", ", " "],
-                chunk_size=1000,
-                chunk_overlap=150,
-                length_function=len
-            )
-            
-            chunks = splitter.split_documents([doc])
+            chunks = _SMALL_DOC_SPLITTER.split_documents([doc])
             
             # If still only one chunk, try more aggressive splitting
             if len(chunks) == 1 and doc_size > 1000:
-                print("🔧 Single chunk detected - applying aggressive splitting")
-                aggressive_splitter = RecursiveCharacterTextSplitter(
-                    separators=["\n", ". ", "; ", ", ", " ", ""],
-                    chunk_size=800,
-                    chunk_overlap=100,
-                    length_function=len
-                )
-                chunks = aggressive_splitter.split_documents([doc])
+                logger.info("Single chunk detected - applying aggressive splitting")
+                chunks = _AGGRESSIVE_SPLITTER.split_documents([doc])
             
             for j, chunk in enumerate(chunks):
                 enhanced_metadata = {
@@ -515,15 +1136,54 @@ def create_optimized_chunks_for_large_docs(documents, config_path="config.json")
                 chunk.metadata = enhanced_metadata
                 all_chunks.append(chunk)
     
-    print(f"✅ Total chunks created: {len(all_chunks)}")
+    logger.info("Total chunks created: %d", len(all_chunks))
     
     # Log chunk distribution for debugging
-    chunk_sizes = [len(chunk.page_content) for chunk in all_chunks]
-    if chunk_sizes:
-        print(f"📊 Chunk size stats - Min: {min(chunk_sizes)}, Max: {max(chunk_sizes)}, Avg: {sum(chunk_sizes)//len(chunk_sizes)}")
+    if all_chunks:
+        chunk_sizes = np.fromiter((len(chunk.page_content) for chunk in all_chunks), dtype=np.int64, count=len(all_chunks))
+        logger.info("Chunk size stats - Min: %d, Max: %d, Avg: %d", chunk_sizes.min(), chunk_sizes.max(), int(chunk_sizes.mean()))
     
     return all_chunks
 
+def deduplicate_chunks(chunks):
+    """Drop chunks whose content repeats an earlier one (same SOP copied into several files)"""
+    seen = set()
+    unique_chunks = []
+    for chunk in chunks:
+        # Strings cache their hash, so membership checks are a single hash lookup
+        if chunk.page_content not in seen:
+            seen.add(chunk.page_content)
+            unique_chunks.append(chunk)
+    return unique_chunks
+
+_DEBUG_LOG_DIR = "debug_logs"
+_debug_log_queue = queue.Queue()
+_debug_log_writer = None
+_debug_log_writer_lock = threading.Lock()
+
+def _write_debug_logs():
+    """Drain queued debug logs to disk, one JSON file per query, in arrival order"""
+    while True:
+        filename, debug_log = _debug_log_queue.get()
+        try:
+            # Create debug logs directory if it doesn't exist
+            os.makedirs(_DEBUG_LOG_DIR, exist_ok=True)
+            # orjson writes UTF-8 bytes directly, so emojis and non-ASCII text stay readable
+            with open(filename, 'wb') as f:
+                f.write(orjson.dumps(debug_log, option=orjson.OPT_INDENT_2))
+            logger.info("Debug log saved to: %s", filename)
+        except Exception as e:
+            logger.warning("Could not save debug log: %s", e)
+        finally:
+            _debug_log_queue.task_done()
+
+def _start_debug_log_writer():
+    global _debug_log_writer
+    with _debug_log_writer_lock:
+        if _debug_log_writer is None:
+            _debug_log_writer = threading.Thread(target=_write_debug_logs, name="debug-log-writer", daemon=True)
+            _debug_log_writer.start()
+
 def log_retrieved_chunks_for_debugging(query, chunks, enhanced_query=None, log_to_file=True):
     """
     Log retrieved chunks for automation team debugging
@@ -536,31 +1196,12 @@ def log_retrieved_chunks_for_debugging(query, chunks, enhanced_query=None, log_t
     """
     import datetime
     
-    print("\n" + "="*80)
-    print("🔍 CHUNK RETRIEVAL DEBUG INFORMATION")
-    print("="*80)
-    print(f"⏰ Timestamp: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"❓ Original Query: {query}")
-    if enhanced_query and enhanced_query != query:
-        print(f"🔧 Enhanced Query: {enhanced_query}")
-    print(f"📊 Total Chunks Retrieved: {len(chunks)}")
-    print("-"*80)
-    
     chunk_details = []
     
     for i, chunk in enumerate(chunks, 1):
         metadata = chunk.metadata
         content = chunk.page_content
         
-        print(f"\n📄 CHUNK {i}:")
-        print(f"   📁 Source: {metadata.get('source', 'Unknown')}")
-        print(f"   📋 Type: {metadata.get('chunk_type', 'standard')}")
-        print(f"   🔢 Index: {metadata.get('chunk_index', 'N/A')}")
-        print(f"   📏 Size: {len(content)} characters")
-        print(f"   📂 File Path: {metadata.get('file_path', 'N/A')}")
-        print(f"   📝 First 100 chars: {content[:100]}...")
-        print(f"   📝 Last 100 chars: ...{content[-100:]}")
-        
         # Store for file logging
         chunk_info = {
             "chunk_number": i,
@@ -574,7 +1215,33 @@ def log_retrieved_chunks_for_debugging(query, chunks, enhanced_query=None, log_t
         }
         chunk_details.append(chunk_info)
     
-    print("="*80)
+    # Console dump only when debug logging is on; skipped entirely (no formatting) otherwise
+    if logger.isEnabledFor(logging.DEBUG):
+        lines = [
+            "=" * 80,
+            "CHUNK RETRIEVAL DEBUG INFORMATION",
+            "=" * 80,
+            f"Timestamp: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            f"Original Query: {query}",
+        ]
+        if enhanced_query and enhanced_query != query:
+            lines.append(f"Enhanced Query: {enhanced_query}")
+        lines.append(f"Total Chunks Retrieved: {len(chunks)}")
+        lines.append("-" * 80)
+        for chunk_info in chunk_details:
+            content = chunk_info["full_content"]
+            lines.extend([
+                f"CHUNK {chunk_info['chunk_number']}:",
+                f"   Source: {chunk_info['source']}",
+                f"   Type: {chunk_info['chunk_type']}",
+                f"   Index: {chunk_info['chunk_index']}",
+                f"   Size: {chunk_info['size']} characters",
+                f"   File Path: {chunk_info['file_path']}",
+                f"   First 100 chars: {content[:100]}...",
+                f"   Last 100 chars: ...{content[-100:]}",
+            ])
+        lines.append("=" * 80)
+        logger.debug("\n".join(lines))
     
     # Save to debug log file if requested
     if log_to_file:
@@ -587,25 +1254,16 @@ def log_retrieved_chunks_for_debugging(query, chunks, enhanced_query=None, log_t
                 "chunks": chunk_details
             }
             
-            import json
-            import os
-            
-            # Create debug logs directory if it doesn't exist
-            debug_dir = "debug_logs"
-            if not os.path.exists(debug_dir):
-                os.makedirs(debug_dir)
-            
             # Save with timestamp
             timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{debug_dir}/chunk_debug_{timestamp}.json"
+            filename = f"{_DEBUG_LOG_DIR}/chunk_debug_{timestamp}.json"
             
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(debug_log, f, indent=2, ensure_ascii=False)
-            
-            print(f"💾 Debug log saved to: {filename}")
+            # Serialising and writing happen on the background writer, off the response path
+            _start_debug_log_writer()
+            _debug_log_queue.put_nowait((filename, debug_log))
             
         except Exception as e:
-            print(f"⚠️ Could not save debug log: {e}")
+            logger.warning("Could not save debug log: %s", e)
     
     return chunk_details
 
@@ -613,45 +1271,29 @@ def analyze_chunk_coverage(chunks):
     """
     Analyze the coverage and distribution of retrieved chunks for debugging
     """
-    print("\n" + "="*60)
-    print("📊 CHUNK COVERAGE ANALYSIS")
-    print("="*60)
-    
-    # Group by source document
-    sources = {}
-    chunk_types = {}
-    
-    for chunk in chunks:
-        source = chunk.metadata.get('source', 'Unknown')
-        chunk_type = chunk.metadata.get('chunk_type', 'standard')
-        
-        if source not in sources:
-            sources[source] = 0
-        sources[source] += 1
-        
-        if chunk_type not in chunk_types:
-            chunk_types[chunk_type] = 0
-        chunk_types[chunk_type] += 1
-    
-    print("📁 Chunks per Source Document:")
-    for source, count in sorted(sources.items()):
-        print(f"   • {source}: {count} chunks")
-    
-    print(f"\n🏷️ Chunks by Type:")
-    for chunk_type, count in sorted(chunk_types.items()):
-        print(f"   • {chunk_type}: {count} chunks")
+    # Group by source document and by chunk type in C-level counting passes
+    sources = dict(Counter(chunk.metadata.get('source', 'Unknown') for chunk in chunks))
+    chunk_types = dict(Counter(chunk.metadata.get('chunk_type', 'standard') for chunk in chunks))
+    total_chars = sum(len(chunk.page_content) for chunk in chunks)
     
     # Calculate coverage statistics
-    total_chars = sum(len(chunk.page_content) for chunk in chunks)
     avg_chunk_size = total_chars / len(chunks) if chunks else 0
     
-    print(f"\n📏 Size Statistics:")
-    print(f"   • Total characters: {total_chars:,}")
-    print(f"   • Average chunk size: {avg_chunk_size:.0f} characters")
-    print(f"   • Number of sources: {len(sources)}")
-    print(f"   • Number of chunk types: {len(chunk_types)}")
-    
-    print("="*60)
+    # Report only when debug logging is on; skipped entirely (no formatting) otherwise
+    if logger.isEnabledFor(logging.DEBUG):
+        lines = ["=" * 60, "CHUNK COVERAGE ANALYSIS", "=" * 60, "Chunks per Source Document:"]
+        lines.extend(f"   • {source}: {count} chunks" for source, count in sorted(sources.items()))
+        lines.append("Chunks by Type:")
+        lines.extend(f"   • {chunk_type}: {count} chunks" for chunk_type, count in sorted(chunk_types.items()))
+        lines.extend([
+            "Size Statistics:",
+            f"   • Total characters: {total_chars:,}",
+            f"   • Average chunk size: {avg_chunk_size:.0f} characters",
+            f"   • Number of sources: {len(sources)}",
+            f"   • Number of chunk types: {len(chunk_types)}",
+            "=" * 60,
+        ])
+        logger.debug("\n".join(lines))
     
     return {
         "sources": sources,